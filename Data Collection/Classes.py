@@ -1,38 +1,33 @@
+# Read only views of one row of the concerts and works tables, e.g. Work(works_df, 10).composer.
+# The tables themselves are stored column by column (see store.py), these only hold a row index.
+
+def _column(name):
+    return property(lambda self: self.table[name].iat[self.row])
+
 class Concert:
-    def __init__(self, id, programID, orchestra, season, concerts, works):
-        self.id = id
-        self.programID = programID
-        self.orchestra = orchestra
-        self.season = season
-        self.concerts = concerts
-        self.works = works
-    
-    # def to_dict(self):
-    #     return {
-    #         "id": self.id,
-    #         "programID": self.programID,
-    #         "orchestra": self.orchestra,
-    #         "season": self.season,
-    #         "concerts": self.concerts,
-    #         "works": self.works
-    #     }
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    id = _column("id")
+    programID = _column("programID")
+    orchestra = _column("orchestra")
+    season = _column("season")
+    concerts = _column("concerts")
 
 class Work:
-    def __init__(self, id, programID, composer, title, movement, conductor, soloists):
-        self.id = id
-        self.programID = programID
-        self.composer = composer
-        self.title = title
-        self.movement = movement
-        self.conductor = conductor
-        self.soloists = soloists
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
 
-    # def to_dict(self):
-    #     return {
-    #         "ID": self.id,
-    #         "composer": self.composer,
-    #         "title": self.title,
-    #         "movement": self.movement,
-    #         "conductor": self.conductor,
-    #         "soloists": self.soloists
-    #     }
\ No newline at end of file
+    id = _column("id")
+    programID = _column("programID")
+    composer = _column("composer")
+    title = _column("title")
+    movement = _column("movement")
+    conductor = _column("conductor")
+    soloists = _column("soloists")
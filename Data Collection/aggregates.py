@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+START_YEAR = 1842 # start date of animation, first date of concerts
+END_YEAR = 2025
+YEAR_RANGES = (1, 5, 10, 25) # "Years Between Each Tick" options, rank tables are precomputed for these
+MAX_TOP_N = 20 # largest "Number of Top" option, rank tables keep this many entities per frame
+
+# Dictionary encode a column of strings, labels are sorted so codes follow alphabetical order
+def encode(values):
+    codes, labels = pd.factorize(values, sort=True)
+    return labels.to_numpy(), codes
+
+# Build an (entity x year) matrix of how many times each entity was programmed per year
+# column start_year is index 0, years outside [start_year, end_year] are dropped
+# weights gives the count of each (code, year) row when the input is already aggregated
+def count_matrix(codes, years, n_entities, start_year, end_year, weights=None):
+    n_years = end_year - start_year + 1
+    codes = np.asarray(codes)
+    offsets = np.asarray(years) - start_year
+    keep = (codes >= 0) & (offsets >= 0) & (offsets < n_years)
+    if weights is not None:
+        weights = np.asarray(weights)[keep]
+    flat = np.bincount(codes[keep] * n_years + offsets[keep], weights=weights, minlength=n_entities * n_years)
+    return flat.reshape(n_entities, n_years).astype(np.int32)
+
+# Build (entity x year) matrices from a long table of yearly counts, one per weight column.
+# Returns the sorted entity names (row order) and the matrices.
+def entity_matrices(table, column, weight_columns):
+    names, codes = encode(table[column])
+    return names, [count_matrix(codes, table["year"], len(names), START_YEAR, END_YEAR, weights=table[weights])
+                   for weights in weight_columns]
+
+# Years of the animation frames for a "Years Between Each Tick" value, starting at START_YEAR
+def frame_years(year_range):
+    return np.append(np.arange(START_YEAR, END_YEAR, step=year_range), END_YEAR)
+
+# Counts per animation frame: frame k covers the years after frame k-1 up to and including frame_years[k],
+# the first frame also includes start_year
+def frame_counts(matrix, frame_years, start_year):
+    cumulative = np.cumsum(matrix, axis=1, dtype=np.int32)
+    at_frames = cumulative[:, np.asarray(frame_years) - start_year]
+    return np.diff(at_frames, axis=1, prepend=0), at_frames
+
+# Prefix sums of an (entity x year) count matrix along the year axis, with a zero column in front:
+# prefix[e, j] is the count of entity e over the first j years, so any range of years is one subtraction
+def prefix_sums(matrix):
+    prefix = np.zeros((matrix.shape[0], matrix.shape[1] + 1), dtype=np.int32) # an entity is never programmed 2^31 times
+    np.cumsum(matrix, axis=1, out=prefix[:, 1:])
+    return prefix
+
+# Counts of the given rows between start and end (inclusive years, clipped to [START_YEAR, END_YEAR]).
+# rows, starts and ends are arrays of one entry per query, a start after its end counts nothing.
+def range_counts(prefix, rows, starts, ends):
+    last = prefix.shape[1] - 1
+    first = np.clip(np.asarray(starts) - START_YEAR, 0, last)
+    after = np.clip(np.asarray(ends) - START_YEAR + 1, 0, last)
+    return np.where(after > first, prefix[rows, after] - prefix[rows, first], 0)
+
+# Long table of how many times each value of columns was programmed in each year (count), in how
+# many programs (unique_count, the "Unique Per Concert?" count) and how many times it was performed
+# (performance_count, once for every performance of its program in the year of that performance, from
+# performances: a programID and year row per performance, year 0 when it has no date). count and
+# unique_count go by the year of the program's first performance. Intermissions are not counted.
+def year_counts(works, program_years, performances, columns):
+    works = works[works["id"] != "0*"]
+    table = works[columns].reset_index(drop=True)
+    table["programID"] = works["programID"].to_numpy()
+    table["year"] = works["programID"].map(program_years).to_numpy()
+    groups = table.groupby(columns + ["year"])
+    total = groups.size().rename("count")
+    unique = table.drop_duplicates(["programID"] + columns).groupby(columns + ["year"]).size().rename("unique_count")
+    # A performance without a date counts in the year of its program
+    performed = table.drop(columns="year").merge(performances[["programID", "year"]], on="programID")
+    performed["year"] = np.where(performed["year"] == 0, performed["programID"].map(program_years), performed["year"])
+    performed = performed.groupby(columns + ["year"]).size().rename("performance_count")
+    counts = pd.concat([total, unique, performed], axis=1).fillna(0).reset_index()
+    return counts.astype({"year": np.int32, "count": np.int32, "unique_count": np.int32, "performance_count": np.int32})
+
+# Key of a work as shown in the work filter dropdowns
+def work_key(composer, title):
+    return composer + ": " + title
+
+# Canonical key of each performed work: its catalog ID without the movement number ("8834*4" -> "8834") and
+# its title with case and spacing normalised, so movements catalogued as separate works share one key
+def canonical_work_keys(ids, titles):
+    prefix = pd.Series(ids, dtype=object).astype(str).str.split("*", n=1).str[0]
+    title = pd.Series(titles, dtype=object).astype(str).str.upper().str.split().str.join(" ")
+    return (prefix + "|" + title).to_numpy()
+
+# Yearly counts of every work, a work being a (composer, title) pair identified by its work_key.
+# collapsed_count counts a work once per program however many of its movements are listed separately.
+def work_year_counts(works, program_years, performances):
+    counts = year_counts(works, program_years, performances, ["composer", "title"])
+    works = works[works["id"] != "0*"]
+    table = pd.DataFrame({"composer": works["composer"].to_numpy(), "title": works["title"].to_numpy(),
+                          "programID": works["programID"].to_numpy(),
+                          "canonical": canonical_work_keys(works["id"].to_numpy(), works["title"].to_numpy())})
+    table["year"] = works["programID"].map(program_years).to_numpy()
+    collapsed = table.drop_duplicates(["programID", "canonical"]).groupby(["composer", "title", "year"]).size()
+    counts = counts.merge(collapsed.rename("collapsed_count").reset_index(), on=["composer", "title", "year"], how="left")
+    counts["collapsed_count"] = counts["collapsed_count"].fillna(0).astype(np.int32)
+    counts.insert(0, "work", work_key(counts["composer"], counts["title"]))
+    return counts
+
+# Catalog of works indexed by work ID (the row of the work in its count matrix, see entity_matrices):
+# canonical title and composer, the dropdown key and the label used for graph traces
+def work_catalog(work_counts):
+    catalog = work_counts[["work", "composer", "title"]].drop_duplicates("work").sort_values("work", ignore_index=True)
+    catalog["label"] = catalog["title"] + " - " + catalog["composer"]
+    return catalog.rename(columns={"work": "key"})
+
+# Codes of the k entities with the largest values, largest first, ties broken by lowest code.
+# A partial selection finds the threshold so only the entities near the top get sorted.
+def top_entities(values, k):
+    if len(values) > k:
+        threshold = np.partition(values, len(values) - k)[len(values) - k]
+        candidates = np.flatnonzero(values >= threshold)
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.argsort(-values[candidates], kind="stable")][:k]
+
+# Rank tables of a count matrix for one year_range: row k holds the top codes of frame k,
+# ranked by running total (cumulative graphs) and by count within the frame (per year graphs)
+def rank_frames(matrix, year_range, k=MAX_TOP_N):
+    windows, totals = frame_counts(matrix, frame_years(year_range)[1:], START_YEAR)
+    cumulative = np.array([top_entities(totals[:, frame], k) for frame in range(totals.shape[1])], dtype=np.int32)
+    per_year = np.array([top_entities(windows[:, frame], k) for frame in range(windows.shape[1])], dtype=np.int32)
+    return cumulative, per_year
+
+# Long table of the rank tables of every entity type, counting mode, view and year_range.
+# matrices maps (entity, counting) -> (names, matrix); ranked entities are stored by name
+# so the table does not depend on how a reader encodes them.
+def rank_index_table(matrices):
+    parts = []
+    for (entity, counting), (names, matrix) in matrices.items():
+        for year_range in YEAR_RANGES:
+            for view, ranks in zip(("cumulative", "per_year"), rank_frames(matrix, year_range)):
+                frames, ranks_in_frame = np.indices(ranks.shape)
+                parts.append(pd.DataFrame({"entity": entity, "counting": counting, "view": view,
+                                           "year_range": np.int32(year_range),
+                                           "frame": frames.ravel().astype(np.int32),
+                                           "rank": ranks_in_frame.ravel().astype(np.int32),
+                                           "name": names[ranks.ravel()]}))
+    return pd.concat(parts, ignore_index=True)
+
+# Rank tables back as arrays of codes: (entity, counting, view, year_range) -> frames x MAX_TOP_N array,
+# where labels maps each entity type to its sorted names
+def load_rank_index(table, labels):
+    index = {}
+    for (entity, counting, view, year_range), group in table.groupby(["entity", "counting", "view", "year_range"]):
+        codes = pd.Index(labels[entity]).get_indexer(group["name"])
+        index[(entity, counting, view, int(year_range))] = codes.reshape(int(group["frame"].max()) + 1, -1)
+    return index
@@ -0,0 +1,234 @@
+import argparse
+import datetime
+import gzip
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmark common.setup(), the create_*_fig builders and the figure callbacks over the UI parameter
+# grid, offline against a fixture dataset that is ingested into a temporary dataframes folder.
+# Records wall time, peak memory and payload size per case as JSON and flags regressions against a baseline.
+# Run from the Data Collection folder:
+#   python benchmarks/benchmark.py                  compare with benchmarks/baseline.json if it exists
+#   python benchmarks/benchmark.py --save-baseline  make this run the baseline
+#   python benchmarks/benchmark.py --programs 140000 a generated fixture 10x the size of the real archive
+# benchmarks/fixture.json is `python generate_programs.py 500 --seed 0 -o benchmarks/fixture.json`.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+sys.path.append(os.path.join(HERE, "..", "plotly_programs"))
+
+# UI parameter grid
+YEAR_RANGES = [1, 5, 10, 25]
+TOP_NS = [5, 10, 15, 20]
+TOGGLES = [False, True]
+SELECTION_SIZES = [3, 10] # selected composers/works, the most programmed first
+
+GROUP_PREFIXES = {"setup": "setup ", "builders": "create_", "callbacks": "callback "} # case names start with these
+
+TOLERANCE = 0.25 # a metric regresses when it grows by more than this fraction of the baseline
+NOISE_SECONDS = 0.002 # and by more than these absolute amounts
+NOISE_BYTES = 64 * 1024
+
+# Dropdown ids of each graph's tuning callback: year range, top N, selection and checklist
+CALLBACK_INPUTS = {
+    "composer-line": ["cu-year-range-selector", "cu-top-N-selector", "cu-composers-selector", "cu-markers-selector"],
+    "composer-kagi": ["kagi-year-range-selector", "kagi-top-N-selector", "kagi-composers-selector", "kagi-markers-selector"],
+    "work-line": ["cu-work-year-range-selector", "cu-work-top-N-selector", "cu-works-selector", "cu-works-markers-selector"],
+    "work-kagi": ["work-kagi-year-range-selector", "work-kagi-top-N-selector", "kagi-works-selector", "work-kagi-markers-selector"],
+}
+
+# Median wall time of repeat calls, then the peak traced memory of one more call
+def measure(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {"wall_s": statistics.median(times), "peak_bytes": peak}
+
+def case_name(group, params):
+    return group + " " + " ".join(name + "=" + str(len(value) if isinstance(value, list) else value)
+                                  for name, value in params.items())
+
+# Parameters of every builder call the UI can make
+def builder_cases(tool):
+    composers = tool.uniq_composers[(-tool.composer_counts.sum(axis=1)).argsort(kind="stable")].tolist()
+    works = tool.work_catalog["key"].to_numpy()[(-tool.work_counts.sum(axis=1)).argsort(kind="stable")].tolist()
+    for builder in [tool.create_overall_fig, tool.create_pop_by_year_fig]:
+        for year_range, top_N, markers, uniq_conc in itertools.product(YEAR_RANGES, TOP_NS, TOGGLES, TOGGLES):
+            yield builder, {"year_range": year_range, "top_N": top_N, "markers": markers, "uniq_conc": uniq_conc}
+        for year_range, size in itertools.product(YEAR_RANGES, SELECTION_SIZES):
+            yield builder, {"year_range": year_range, "top_N": size, "selected_composers": composers[:size]}
+    for builder in [tool.create_overall_work_fig, tool.create_work_pop_by_year_fig]:
+        for year_range, top_N, markers, collapse in itertools.product(YEAR_RANGES, TOP_NS, TOGGLES, TOGGLES):
+            yield builder, {"year_range": year_range, "top_N": top_N, "markers": markers, "collapse": collapse}
+        for year_range, size in itertools.product(YEAR_RANGES, SELECTION_SIZES):
+            yield builder, {"year_range": year_range, "top_N": size, "selected_works": works[:size]}
+
+def bench_setup(common, repeat, results):
+    for compact in TOGGLES:
+        _, result = measure(lambda: common.setup(compact), repeat)
+        results[case_name("setup", {"compact": compact})] = result
+
+def bench_builders(tool, figure_cache, repeat, results):
+    for builder, params in builder_cases(tool):
+        figure, result = measure(lambda: builder.uncached(**params), repeat)
+        body = figure_cache.dumps(figure)
+        result["payload_bytes"] = len(body)
+        result["gzip_bytes"] = len(gzip.compress(body))
+        results[case_name(builder.__name__, params)] = result
+
+# Answer of a Dash callback, as the browser gets it: post(path, body) posts a callback request and returns the
+# decoded JSON. A background callback answers with a job, which is polled every poll_seconds until it is done.
+def dash_callback(post, body, poll_seconds):
+    response = post("/_dash-update-component", body)
+    if "job" in response:
+        query = "?cacheKey=%s&job=%s" % (response["cacheKey"], response["job"])
+        response = {}
+        while "response" not in response:
+            time.sleep(poll_seconds)
+            response = post("/_dash-update-component" + query, body) or {}
+    return response["response"]
+
+# Body of a callback request for outputs ("id.property") from inputs (ids of "value" properties, or "id.property")
+def callback_body(outputs, inputs, values):
+    outputs = [outputs] if isinstance(outputs, str) else outputs
+    specs = [dict(zip(["id", "property"], output.split(".", 1))) for output in outputs]
+    inputs = [input if "." in input else input + ".value" for input in inputs]
+    return {"output": outputs[0] if len(outputs) == 1 else ".." + "...".join(outputs) + "..",
+            "outputs": specs[0] if len(specs) == 1 else specs,
+            "inputs": [{"id": input.split(".", 1)[0], "property": input.split(".", 1)[1], "value": value}
+                       for input, value in zip(inputs, values)],
+            "changedPropIds": [inputs[0]], "state": []}
+
+# Output of the background callback of each graph building the figures its tuning callback did not find in the
+# cache, from the callback outputs of the app (/_dash-dependencies)
+def build_outputs(outputs):
+    return {graph: output for graph in CALLBACK_INPUTS for output in outputs if output.startswith(graph + "-frames.data@")}
+
+# URL of the figure a change of a graph's tuners leads to, as the browser gets it: straight from the tuning callback
+# when the figure is cached, otherwise from the background callback building the figure the tuning callback asks for,
+# once the browser's debounce delay has gone by
+def figure_callback(post, graph, values, build_output, poll_seconds, debounce_seconds):
+    body = callback_body([graph + "-frames.data", graph + "-request.data"], CALLBACK_INPUTS[graph], values)
+    response = dash_callback(post, body, poll_seconds)
+    if graph + "-frames" in response:
+        return response[graph + "-frames"]["data"]
+    time.sleep(debounce_seconds)
+    body = callback_body(build_output, [graph + "-pending.data"], [response[graph + "-request"]["data"]])
+    return dash_callback(post, body, poll_seconds)[graph + "-frames"]["data"]
+
+# A tuning callback and the figure fetch it leads to, as the browser makes them, with a cold figure cache
+def bench_callbacks(tool, repeat, results):
+    client = tool.server.test_client()
+    post = lambda path, body: client.post(path, json=body).get_json()
+    outputs = build_outputs(tool.app.callback_map)
+    for graph in CALLBACK_INPUTS:
+        for year_range, top_N in itertools.product(YEAR_RANGES, TOP_NS):
+
+            def request():
+                tool.fig_cache.clear()
+                url = figure_callback(post, graph, [year_range, top_N, None, None], outputs.get(graph),
+                                      tool.common.JOB_POLL_MS / 1000, tool.common.FIGURE_DEBOUNCE_MS / 1000)
+                return client.get(url, headers={"Accept-Encoding": "br, gzip"}).data
+
+            payload, result = measure(request, repeat)
+            result["payload_bytes"] = len(payload)
+            results[case_name("callback " + graph, {"year_range": year_range, "top_N": top_N})] = result
+
+# Cases whose metrics grew past the tolerance, as (case, metric, baseline value, new value)
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        for metric, noise in [("wall_s", NOISE_SECONDS), ("peak_bytes", NOISE_BYTES), ("payload_bytes", 0)]:
+            old = baseline.get(name, {}).get(metric)
+            new = result.get(metric)
+            if old is not None and new is not None and new > old * (1 + tolerance) and new - old > noise:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+# Ingest the fixture, or a generated one when programs is given, into a temporary dataframes folder and
+# point the app modules at it (DATAFRAMES_DIR). Call before importing them. Returns the folder and the fixture path.
+def prepare_dataset(fixture, programs=None, seed=0):
+    data_dir = tempfile.mkdtemp(prefix="benchmark-dataframes-")
+    os.environ["DATAFRAMES_DIR"] = data_dir
+    os.environ["LAZY_INIT"] = "0"
+    if programs:
+        import generate_programs
+        fixture = os.path.join(data_dir, "complete.json")
+        generate_programs.write(fixture, generate_programs.generate(programs, seed))
+    import program_parser
+    program_parser.parse_streaming(fixture)
+    return data_dir, fixture
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark setup(), the figure builders and callbacks against a fixture dataset")
+    parser.add_argument("--fixture", default=os.path.join(HERE, "fixture.json"), help="complete.json-shaped fixture")
+    parser.add_argument("--programs", type=int, help="generate a fixture with this many programs instead (see generate_programs.py)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated fixture")
+    parser.add_argument("--output", default=os.path.join(HERE, "results.json"), help="where to write the results")
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"), help="results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to the baseline too")
+    parser.add_argument("--repeat", type=int, default=3, help="timed calls per case")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed growth of a metric")
+    parser.add_argument("--only", choices=["setup", "builders", "callbacks"], action="append",
+                        help="run only these groups (can be given more than once)")
+    args = parser.parse_args()
+    groups = args.only or ["setup", "builders", "callbacks"]
+
+    data_dir, fixture = prepare_dataset(args.fixture, args.programs, args.seed)
+    import program_parser
+    import common
+    import figure_cache
+    import analysis_tool
+
+    results = {}
+    if "setup" in groups:
+        bench_setup(common, args.repeat, results)
+    if "builders" in groups:
+        bench_builders(analysis_tool, figure_cache, args.repeat, results)
+    if "callbacks" in groups:
+        bench_callbacks(analysis_tool, args.repeat, results)
+
+    programs = sum(1 for _ in program_parser.iter_programs(fixture))
+    report = {"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "fixture": "generated seed %d" % args.seed if args.programs else os.path.basename(fixture),
+                       "programs": programs, "repeat": args.repeat, "python": platform.python_version(),
+                       "machine": platform.machine(), "cpus": os.cpu_count()},
+              "results": results}
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=1)
+
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    for group in groups:
+        walls = [result["wall_s"] for name, result in results.items() if name.startswith(GROUP_PREFIXES[group])]
+        print("%-10s %4d cases  total %.2fs  max %.3fs" % (group, len(walls), sum(walls), max(walls)))
+    print("Results saved to " + args.output)
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file)["results"], args.tolerance)
+    for name, metric, old, new in regressions:
+        print("REGRESSION %s %s: %s -> %s (%+.0f%%)" % (name, metric, old, new, (new / old - 1) * 100 if old else float("inf")))
+    print("%d regressions against %s" % (len(regressions), args.baseline))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
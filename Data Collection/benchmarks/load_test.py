@@ -0,0 +1,262 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import benchmark
+
+# Load test the Dash app under gunicorn: start it on a fixture dataset for each workers x threads
+# configuration, replay realistic sessions from many concurrent simulated clients (tab switches,
+# year range / top N changes and composer filters, each a _dash-update-component call followed by
+# the figure fetch the browser makes) and report latency percentiles, throughput and worker memory.
+# Run from the Data Collection folder:
+#   python benchmarks/load_test.py --configs 1x1 2x4 4x2 --clients 16 --duration 30
+
+PLOTLY_PROGRAMS = os.path.join(benchmark.HERE, "..", "plotly_programs")
+JOB_POLL_SECONDS = 0.1 # as often as the browser polls background callbacks (common.JOB_POLL_MS)
+FIGURE_DEBOUNCE_SECONDS = 0.3 # as long as the browser holds back a background figure job (common.FIGURE_DEBOUNCE_MS)
+
+# Graphs of each tab with the ids of their tuning dropdowns: year range, top N, selection and checklist
+TABS = {
+    "composer-popularity-tab": {graph: ids for graph, ids in benchmark.CALLBACK_INPUTS.items() if graph.startswith("composer")},
+    "work-popularity-tab": {graph: ids for graph, ids in benchmark.CALLBACK_INPUTS.items() if graph.startswith("work")},
+}
+CHECKLISTS = {"composer": [None, ["Markers?"], ["Unique Per Concert?"], ["Markers?", "Unique Per Concert?"]],
+              "work": [None, ["Markers?"], ["Collapse Movements?"], ["Markers?", "Collapse Movements?"]]}
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+# Children of the gunicorn master with their resident and proportional set sizes in bytes
+def worker_memory(master_pid):
+    try:
+        with open("/proc/%d/task/%d/children" % (master_pid, master_pid)) as file:
+            pids = [int(pid) for pid in file.read().split()]
+    except OSError: # not Linux
+        return {}
+    memory = {}
+    for pid in pids:
+        try:
+            with open("/proc/%d/smaps_rollup" % pid) as file:
+                fields = dict(line.split(":", 1) for line in file if ":" in line and not line[0].isdigit())
+        except OSError:
+            continue
+        memory[pid] = {name.lower(): int(fields[name].split()[0]) * 1024 for name in ["Rss", "Pss"] if name in fields}
+    return memory
+
+# One simulated browser: dash callbacks plus figure fetches with its own ETag cache
+class Client:
+    def __init__(self, base_url, rng, build_outputs):
+        self.base_url = base_url
+        self.build_outputs = build_outputs # graph -> output of its background build callback
+        self.rng = rng
+        self.etags = {} # figure url -> etag
+        self.options = {} # dropdown id -> options, read from the rendered tabs
+
+    def request(self, path, body=None, headers={}):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.base_url + path, data=data, headers=dict(headers))
+        if body is not None:
+            request.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, response.read(), response.headers
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), error.headers
+
+    def post(self, path, body):
+        status, data, _ = self.request(path, body)
+        if status == 204: # background job not done yet
+            return {}
+        if status != 200:
+            raise RuntimeError("callback %s returned %d" % (body["output"], status))
+        return json.loads(data)
+
+    def callback(self, output, inputs):
+        component, prop = output.rsplit(".", 1)
+        body = benchmark.callback_body(output, [id for id, _ in inputs], [value for _, value in inputs])
+        return benchmark.dash_callback(self.post, body, JOB_POLL_SECONDS)[component][prop]
+
+    # Fetch a figure the way the browser does, revalidating a copy it already has
+    def fetch(self, url):
+        headers = {"Accept-Encoding": "br, gzip"}
+        if url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+        status, data, response_headers = self.request(url, headers=headers)
+        if status == 200:
+            self.etags[url] = response_headers.get("ETag")
+        elif status != 304:
+            raise RuntimeError("figure %s returned %d" % (url, status))
+        return status
+
+    def switch_tab(self, tab):
+        content = self.callback("tab-content.children", [("graph-tabs", tab)])
+        find_dropdowns(content, self.options)
+        # A new tab shows its graphs with their default figures (its other stores hold build requests)
+        for component in find_stores(content):
+            if component["props"]["id"].endswith("-frames"):
+                self.fetch(component["props"]["data"])
+
+    # Change one tuner of a graph and load the figure it leads to
+    def tune(self, graph, ids):
+        year_range = self.rng.choice([1, 5, 5, 5, 10, 25])
+        top_N = self.rng.choice([5, 10, 10, 15, 20])
+        options = self.options.get(ids[2]) or []
+        selection = None
+        if options and self.rng.random() < 0.3:
+            # Users mostly filter by popular names, which come first in the dropdown
+            selection = [options[min(len(options) - 1, int(self.rng.expovariate(0.1)))] for _ in range(self.rng.randint(1, 5))]
+            selection = list(dict.fromkeys(option["value"] if isinstance(option, dict) else option for option in selection))
+        checklist = self.rng.choice(CHECKLISTS[graph.split("-")[0]])
+        url = benchmark.figure_callback(self.post, graph, [year_range, top_N, selection, checklist], self.build_outputs.get(graph),
+                                        JOB_POLL_SECONDS, FIGURE_DEBOUNCE_SECONDS)
+        return self.fetch(url)
+
+def find_components(tree, match):
+    if isinstance(tree, dict):
+        if match(tree):
+            yield tree
+        for value in tree.values():
+            yield from find_components(value, match)
+    elif isinstance(tree, list):
+        for value in tree:
+            yield from find_components(value, match)
+
+def find_dropdowns(tree, options):
+    for component in find_components(tree, lambda node: node.get("type") == "Dropdown" and "props" in node):
+        options[component["props"]["id"]] = component["props"].get("options")
+
+def find_stores(tree):
+    return list(find_components(tree, lambda node: node.get("type") == "Store" and "props" in node))
+
+# A user session: open a tab, tune its graphs a few times, sometimes switch tab, until the deadline
+def run_client(base_url, build_outputs, seed, deadline, think, samples, errors):
+    rng = random.Random(seed)
+    client = Client(base_url, rng, build_outputs)
+    tab = rng.choice(list(TABS))
+    action = ("switch_tab", tab, None)
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            if action[0] == "switch_tab":
+                client.switch_tab(action[1])
+                samples.append(("tab switch", time.monotonic() - start))
+            else:
+                status = client.tune(action[1], action[2])
+                samples.append(("tune" if status == 200 else "tune (304)", time.monotonic() - start))
+        except Exception as error:
+            errors.append(str(error))
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+        if rng.random() < 0.15:
+            tab = rng.choice(list(TABS))
+            action = ("switch_tab", tab, None)
+        else:
+            graph = rng.choice(list(TABS[tab]))
+            action = ("tune", graph, TABS[tab][graph])
+
+def start_server(workers, threads, port, data_dir):
+    env = dict(os.environ, DATAFRAMES_DIR=data_dir)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "analysis_tool:server", "--workers", str(workers),
+                               "--threads", str(threads), "--bind", "127.0.0.1:%d" % port, "--log-level", "warning"],
+                              cwd=PLOTLY_PROGRAMS, env=env)
+    base_url = "http://127.0.0.1:%d" % port
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited with %d" % server.returncode)
+        try:
+            with urllib.request.urlopen(base_url + "/_dash-layout", timeout=5):
+                return server, base_url
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+def run_config(workers, threads, args, data_dir):
+    # Every configuration starts from a cold figure cache
+    shutil.rmtree(os.path.join(data_dir, "figure_cache"), ignore_errors=True)
+    server, base_url = start_server(workers, threads, args.port, data_dir)
+    try:
+        with urllib.request.urlopen(base_url + "/_dash-dependencies", timeout=30) as response:
+            build_outputs = benchmark.build_outputs([dependency["output"] for dependency in json.load(response)])
+        samples, errors, memory = [], [], []
+        deadline = time.monotonic() + args.duration
+        clients = [threading.Thread(target=run_client, args=(base_url, build_outputs, args.seed * 1000 + number, deadline, args.think, samples, errors))
+                   for number in range(args.clients)]
+        start = time.monotonic()
+        for client in clients:
+            client.start()
+        while any(client.is_alive() for client in clients):
+            memory.append(worker_memory(server.pid))
+            time.sleep(0.5)
+        elapsed = time.monotonic() - start
+        memory.append(worker_memory(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [latency for _, latency in samples]
+    result = {"workers": workers, "threads": threads, "clients": args.clients, "interactions": len(samples),
+              "errors": len(errors), "throughput_per_s": len(samples) / elapsed,
+              "latency_s": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99)},
+              "by_action": {}}
+    for action in sorted({action for action, _ in samples}):
+        values = [latency for name, latency in samples if name == action]
+        result["by_action"][action] = {"count": len(values), "p50": percentile(values, 50),
+                                       "p95": percentile(values, 95), "p99": percentile(values, 99)}
+    # Peak over the run of the total across workers, and of the largest worker
+    snapshots = [snapshot for snapshot in memory if snapshot]
+    if snapshots:
+        result["memory_bytes"] = {"total_rss": max(sum(worker["rss"] for worker in snapshot.values()) for snapshot in snapshots),
+                                  "total_pss": max(sum(worker.get("pss", 0) for worker in snapshot.values()) for snapshot in snapshots),
+                                  "max_worker_rss": max(worker["rss"] for snapshot in snapshots for worker in snapshot.values())}
+    if errors:
+        result["first_errors"] = errors[:5]
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Dash app under gunicorn")
+    parser.add_argument("--configs", nargs="+", default=["1x1", "2x1", "2x4"], help="WORKERSxTHREADS gunicorn configurations")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds each configuration is loaded")
+    parser.add_argument("--think", type=float, default=0.2, help="mean seconds a user waits between actions, 0 for none")
+    parser.add_argument("--fixture", default=os.path.join(benchmark.HERE, "fixture.json"), help="complete.json-shaped fixture")
+    parser.add_argument("--programs", type=int, help="generate a fixture with this many programs instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", default=os.path.join(benchmark.HERE, "load_results.json"))
+    args = parser.parse_args()
+
+    data_dir, _ = benchmark.prepare_dataset(args.fixture, args.programs, args.seed)
+    results = []
+    for config in args.configs:
+        workers, threads = (int(part) for part in config.split("x"))
+        result = run_config(workers, threads, args, data_dir)
+        results.append(result)
+        latency = result["latency_s"]
+        memory = result.get("memory_bytes", {})
+        print("%dx%d: %5d interactions %6.1f/s  p50 %.3fs  p95 %.3fs  p99 %.3fs  errors %d  workers rss %.0f MB pss %.0f MB" % (
+            workers, threads, result["interactions"], result["throughput_per_s"], latency["p50"] or 0, latency["p95"] or 0,
+            latency["p99"] or 0, result["errors"], memory.get("total_rss", 0) / 1e6, memory.get("total_pss", 0) / 1e6))
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    with open(args.output, "w") as file:
+        json.dump({"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "clients": args.clients,
+                            "duration_s": args.duration, "think_s": args.think, "cpus": os.cpu_count(),
+                            "fixture": "generated %d programs, seed %d" % (args.programs, args.seed) if args.programs else os.path.basename(args.fixture)},
+                   "results": results}, file, indent=1)
+    print("Results saved to " + args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import bisect
+import itertools
+import json
+import random
+import uuid
+
+# Generate a synthetic complete.json in the NY Philharmonic performance history schema, at any scale,
+# to test ingest, setup() and the figure builders with more programs than the real archive has.
+# It reproduces the quirks the code has to handle (see database_errors.txt): intermissions as "0*"
+# works, dictionary workTitles, ";"-separated conductors, double spaces in names, movements listed
+# as separate works, programs performed on several dates, and Zipf-like popularity of composers
+# and of the works of each composer. The same seed always gives the same file.
+
+START_YEAR = 1842
+END_YEAR = 2025
+
+ORCHESTRAS = ["New York Philharmonic", "New York Symphony", "Stadium-NY Philharmonic", "Musicians from the New York Philharmonic",
+              "Members of NY Philharmonic", "Boston Symphony Orchestra", "Chicago Symphony Orchestra", "Philadelphia Orchestra"]
+EVENT_TYPES = [("Subscription Season", 60), ("Non-Subscription", 12), ("Tour", 10), ("Runout", 6), ("Parks", 5),
+               ("Young People's Concert", 4), ("Chamber", 3)]
+VENUES = [("Carnegie Hall", "Manhattan, NY"), ("Avery Fisher Hall", "Manhattan, NY"), ("David Geffen Hall", "Manhattan, NY"),
+          ("Apollo Rooms", "Manhattan, NY"), ("Metropolitan Opera House", "Manhattan, NY"), ("Brooklyn Academy of Music", "Brooklyn, NY"),
+          ("Great Lawn, Central Park", "Manhattan, NY"), ("Symphony Hall", "Boston, MA"), ("Kennedy Center", "Washington, DC")]
+TIMES = ["8:00PM", "8:30PM", "7:30PM", "2:00PM", "2:30PM", "11:00AM"]
+FORMS = ["SYMPHONY NO. %d", "CONCERTO, PIANO, NO. %d", "CONCERTO, VIOLIN, NO. %d", "OVERTURE NO. %d", "SUITE NO. %d",
+         "QUARTET, STRING, NO. %d", "SERENADE NO. %d", "TONE POEM NO. %d"]
+MOVEMENTS = ["Allegro", "Andante", "Adagio", "Scherzo: Allegro vivace", "Finale: Presto", "Largo", "Menuetto"]
+FIRST_NAMES = ["Johann", "Ludwig", "Wolfgang", "Franz", "Pyotr", "Antonín", "Gustav", "Clara", "Amy", "Gerardo", "Camille",
+               "Sergei", "Igor", "Béla", "Florence", "Aaron", "Leonard", "Joan", "Carl", "Édouard"]
+LAST_NAMES = ["Bach", "Beethoven", "Mozart", "Schubert", "Tchaikovsky", "Dvořák", "Mahler", "Schumann", "Beach", "Matos Rodríguez",
+              "Saint-Saëns", "Rachmaninoff", "Stravinsky", "Bartók", "Price", "Copland", "Bernstein", "Tower", "Weber", "Lalo"]
+INSTRUMENTS = ["Piano", "Violin", "Cello", "Soprano", "Tenor", "Baritone", "Flute", "Clarinet"]
+
+# Sample from weights 1/rank^exponent, the first item being the most popular
+class Zipf:
+    def __init__(self, items, exponent):
+        self.items = items
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(len(items))))
+
+    def sample(self, rng):
+        return self.items[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+# A name in the archive's "Last,  First" form, with its double spaces. Different numbers never share a last name.
+def person_name(rng, number):
+    last = LAST_NAMES[number % len(LAST_NAMES)] + ("" if number < len(LAST_NAMES) else " " + str(number))
+    return "%s,  %s" % (last, rng.choice(FIRST_NAMES))
+
+# Composers with the first year they can be programmed and their works, each work a title and its movements
+def make_composers(rng, n_composers, works_per_composer):
+    composers = []
+    for number in range(n_composers):
+        debut = rng.randint(START_YEAR - 100, END_YEAR - 10) if number >= 10 else START_YEAR
+        works = []
+        for work in range(works_per_composer):
+            title = rng.choice(FORMS).replace(" NO. ", " NO.  " if rng.random() < 0.05 else " NO. ") % (work + 1)
+            works.append((number * works_per_composer + work + 1, title, rng.sample(MOVEMENTS, rng.randint(2, 4))))
+        composers.append((person_name(rng, number), debut, Zipf(works, 1.2)))
+    return composers
+
+def make_conductors(rng, n_conductors):
+    conductors = []
+    for number in range(n_conductors):
+        start = rng.randint(START_YEAR, END_YEAR)
+        conductors.append((person_name(rng, number), start, start + rng.randint(5, 30)))
+    return conductors
+
+def conductor_name(rng, conductors, year):
+    active = [name for name, start, end in conductors if start <= year <= end] or [conductors[0][0]]
+    roll = rng.random()
+    if roll < 0.05:
+        return ";  ".join(rng.sample(active, min(2, len(active)))) # shared program
+    if roll < 0.07:
+        return "Not conducted"
+    if roll < 0.08:
+        return "; " + rng.choice(active) # stray semicolon in front
+    return rng.choice(active)
+
+def make_work(rng, composer, work, conductor, soloists):
+    work_id, title, movements = work
+    entries = []
+    if rng.random() < 0.03:
+        # A movement arranged from a larger work, named in a dictionary title
+        parts = [{"_": rng.choice(movements).upper() + " FROM  (ARR. Ens.)", "em": title}]
+        ids = [str(work_id) + "*"]
+        names = [None]
+    elif rng.random() < 0.15:
+        # Some movements performed on their own, each listed as a work
+        names = movements[:rng.randint(1, len(movements))]
+        ids = ["%d*%d" % (work_id, number + 1) for number in range(len(names))]
+        parts = [title] * len(names)
+    else:
+        ids, parts, names = [str(work_id) + "*"], [title], [None]
+    for id, part, movement in zip(ids, parts, names):
+        entry = {"ID": id, "composerName": composer, "workTitle": part}
+        if movement is not None:
+            entry["movement"] = movement
+        entry["conductorName"] = conductor
+        entry["soloists"] = soloists
+        entries.append(entry)
+    return entries
+
+def make_program(rng, number, year, composers, conductors, orchestras):
+    conductor = conductor_name(rng, conductors, year)
+    works = []
+    for _ in range(rng.choice([1, 2, 3, 3, 4, 4, 5, 6, 8])):
+        for _ in range(10): # skip composers who only get programmed later
+            name, debut, catalog = composers.sample(rng)
+            if debut <= year:
+                break
+        soloists = []
+        if rng.random() < 0.3:
+            soloists = [{"soloistName": person_name(rng, rng.randint(0, 500)), "soloistInstrument": rng.choice(INSTRUMENTS),
+                         "soloistRoles": "S"} for _ in range(rng.randint(1, 2))]
+        works.extend(make_work(rng, name, catalog.sample(rng), conductor, soloists))
+    if len(works) > 1 and rng.random() < 0.7:
+        works.insert(len(works) // 2, {"ID": "0*", "interval": "Intermission"})
+
+    event_type = rng.choices([event for event, _ in EVENT_TYPES], [weight for _, weight in EVENT_TYPES])[0]
+    venue, location = rng.choice(VENUES)
+    month, day = rng.randint(1, 12), rng.randint(1, 25)
+    concerts = [{"eventType": event_type, "Location": location, "Venue": venue,
+                 "Date": "%04d-%02d-%02dT05:00:00Z" % (year, month, day + offset), "Time": rng.choice(TIMES)}
+                for offset in range(rng.choice([1, 1, 1, 2, 2, 3, 4]))]
+    season = "%d-%02d" % (year - 1, year % 100) if month < 9 else "%d-%02d" % (year, (year + 1) % 100)
+    orchestra = orchestras[0] if rng.random() < 0.8 else rng.choice(orchestras)
+    return {"id": str(uuid.UUID(int=rng.getrandbits(128))), "programID": str(number), "orchestra": orchestra,
+            "season": season, "concerts": concerts, "works": works}
+
+# Yield n programs in programID order, most of them by the first orchestra and more of them in later years like the real archive
+def generate(n_programs, seed=0, n_composers=2000, works_per_composer=12, n_conductors=150, orchestras=3):
+    rng = random.Random(seed)
+    composers = Zipf(make_composers(rng, n_composers, works_per_composer), 1.1)
+    conductors = make_conductors(rng, n_conductors)
+    years = sorted(START_YEAR + int((END_YEAR - START_YEAR) * rng.random() ** 0.6) for _ in range(n_programs))
+    for number, year in enumerate(years):
+        yield make_program(rng, 1000 + number, year, composers, conductors, ORCHESTRAS[:orchestras])
+
+# Write the programs one at a time, so the file can be much larger than memory
+def write(path, programs):
+    with open(path, "w") as file:
+        file.write('{"programs": [\n')
+        for number, program in enumerate(programs):
+            if number:
+                file.write(",\n")
+            json.dump(program, file, ensure_ascii=False)
+        file.write("\n]}\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic complete.json")
+    parser.add_argument("programs", type=int, help="number of programs (the real archive has about 14,000)")
+    parser.add_argument("-o", "--output", default="complete.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--composers", type=int, default=2000)
+    parser.add_argument("--works-per-composer", type=int, default=12)
+    parser.add_argument("--conductors", type=int, default=150)
+    parser.add_argument("--orchestras", type=int, default=3, choices=range(1, len(ORCHESTRAS) + 1), metavar="1-%d" % len(ORCHESTRAS))
+    args = parser.parse_args()
+    write(args.output, generate(args.programs, args.seed, args.composers, args.works_per_composer, args.conductors, args.orchestras))
+    print("%d programs written to %s" % (args.programs, args.output))
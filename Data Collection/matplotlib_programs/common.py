@@ -1,4 +1,9 @@
-import pandas as pd
+import os
+import sys
+
+# Shared ingest modules live in the Data Collection folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import store
 
 # CONSTANTS
 DF_FILE_LOC_MPL = "../dataframes/"
@@ -13,9 +18,9 @@ def normalize_title(title):
     
 # MAIN SETUP FUNCTION
 def setup():
-    # Unpickle dataframes
-    concerts = pd.read_pickle(DF_FILE_LOC_MPL + "concerts.pkl")
-    works = pd.read_pickle(DF_FILE_LOC_MPL + "works.pkl")
+    # Load dataframes
+    concerts = store.read_table(DF_FILE_LOC_MPL, "concerts")
+    works = store.read_table(DF_FILE_LOC_MPL, "works")
 
     # Clean works df
     works = works.query('id != "0*"') # remove all entries that are intermissions
@@ -23,11 +28,11 @@ def setup():
     works['n_title'] = works['title'].apply(normalize_title)
 
     ## Add Date column to concerts and works
-    # extract date from concert-info dictionary as new column
-    concerts['date'] = concerts['concerts'].apply(lambda x : x[0].get('Date', None))
-    # Convert extracted date to ISO8601, UTC datetime format
-    concerts['date'] = pd.to_datetime(concerts['date'], utc=True)
-    # Merge works with the datetime column
+    # first performance of each program as a YYYYMMDD integer, taken from the performances table written at ingest
+    performances = store.read_table(DF_FILE_LOC_MPL, "performances", ["programID", "date"])
+    first = performances.drop_duplicates("programID").set_index("programID")["date"]
+    concerts['date'] = concerts['programID'].map(first).fillna(0).astype('int32')
+    # Merge works with the date column
     works = works.merge(concerts[['programID', 'date']], on='programID', how='left')
 
     return concerts, works
\ No newline at end of file
@@ -1,58 +1,179 @@
-import pandas as pd
+import time
+import_start = time.perf_counter()
+import argparse
+import csv
+import functools
+import inspect
+import io
+import json
+import sys
+import threading
+import urllib.parse
 import numpy as np
-import plotly.graph_objects as go
-from dash import Dash, dcc, html, callback, Output, Input
+import plotly.io as pio
+from dash import Dash, dcc, html, callback, clientside_callback, ClientsideFunction, Output, Input, State, no_update
+from flask import Response, abort, request
 import common
-
-# Import necessary dataframes and get list of composers
-concerts, works = common.setup()
-uniq_composers = works["composer"].unique()
-uniq_composers.sort()
-uniq_works = works["title"].unique()
-uniq_works.sort()
-
-# Get unique works with their associated composers
-uniq_works_df = works[["composer", "title"]].drop_duplicates()
-uniq_works_with_composers = sorted(uniq_works_df["composer"].str.cat(uniq_works_df["title"], sep=': ').tolist())
-
-# Group works by their year
-works_by_year = works.groupby(works.date.dt.year)
-start_year = 1842 # start date of animation, first date of concerts
-end_year = 2025
+import aggregates
+import figure_cache
+import jobs
+import metrics
+import search
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# Seconds spent getting a worker ready to answer requests, per phase (see cold_start_report)
+cold_start = {"imports": time.perf_counter() - import_start}
+module_start = time.perf_counter()
+
+dataset_version = common.dataset_version()
+
+start_year = aggregates.START_YEAR # start date of animation, first date of concerts
+end_year = aggregates.END_YEAR
+
+# Figures are sent as plain dicts, so give them the template go.Figure would have added
+template = pio.templates[pio.templates.default].to_plotly_json()
+
+# Figures are pure functions of their arguments, so cache them for every worker
+fig_cache = figure_cache.FigureCache(common.FIG_CACHE_DIR, dataset_version, common.FIG_CACHE_MEMORY_BYTES, common.FIG_CACHE_DISK_BYTES)
+figure_dependencies = [aggregates, common.store] # modules the figures are computed with, besides this one
+
+# Import necessary dataframes. The count matrices, work catalog and rank index are built by load_dataset,
+# at import, or with LAZY_INIT=1 in a background thread and on first use, so a new worker answers right away.
+dataset_lock = threading.Lock()
+dataset_loaded = False
+
+def load_dataset():
+    global dataset_loaded, uniq_composers, composer_counts, uniq_composer_counts, composer_index, uniq_works, work_counts, \
+        work_collapsed_counts, work_catalog, work_labels, work_index, rank_index, prefix_sums, composer_search, work_search
+    if dataset_loaded:
+        return
+    with dataset_lock:
+        if dataset_loaded:
+            return
+        start = time.perf_counter()
+
+        # Memory-map the (entity x year) count matrices precomputed at ingest, so every worker shares one copy:
+        # composers counted every time they are programmed and for "Unique Per Concert?", works ((composer, title) pairs)
+        # counted every time they are programmed and for "Collapse Movements?" once per program however many of their movements
+        # are listed separately
+        uniq_composers, composer_counts = common.store.read_matrix(common.DF_FILE_LOC_MPL, "composer_count_matrix")
+        _, uniq_composer_counts = common.store.read_matrix(common.DF_FILE_LOC_MPL, "composer_unique_count_matrix")
+        composer_index = {composer: code for code, composer in enumerate(uniq_composers)}
+        uniq_works, work_counts = common.store.read_matrix(common.DF_FILE_LOC_MPL, "work_count_matrix")
+        _, work_collapsed_counts = common.store.read_matrix(common.DF_FILE_LOC_MPL, "work_collapsed_count_matrix")
+
+        # Work catalog: work ID (count matrix row) -> title, composer, dropdown key and trace label
+        work_catalog = common.store.read_table(common.DF_FILE_LOC_MPL, "work_catalog")
+        work_labels = work_catalog["label"].to_numpy()
+        work_index = {key: work_id for work_id, key in enumerate(work_catalog["key"])}
+
+        # Top entities of every frame precomputed at ingest: (entity, counting, view, year_range) -> frames x MAX_TOP_N codes
+        rank_index = aggregates.load_rank_index(common.store.read_table(common.DF_FILE_LOC_MPL, "rank_index"),
+                                                {"composer": uniq_composers, "work": uniq_works})
+
+        # Prefix sums of the count matrices over the years for the range count API: (entity, counting) -> matrix
+        prefix_sums = {(entity, counting): common.store.read_matrix(common.DF_FILE_LOC_MPL, entity + "_" + counting + "_prefix")[1]
+                       for entity, counting in [("composer", "count"), ("composer", "unique_count"), ("composer", "performance_count"),
+                                                 ("work", "count"), ("work", "collapsed_count"), ("work", "performance_count")]}
+
+        # Search indexes of the filter dropdowns, ranked by how many times each name was programmed
+        composer_search = search.SearchIndex(uniq_composers, prefix_sums[("composer", "count")][:, -1])
+        work_search = search.SearchIndex(uniq_works, prefix_sums[("work", "count")][:, -1])
+
+        cold_start["dataset"] = time.perf_counter() - start
+        dataset_loaded = True
+
+        # Build the default figure of every graph, which the tabs point to, so web workers find them in the cache
+        start = time.perf_counter()
+        for builder in figure_builders.values():
+            builder()
+        cold_start["figures"] = time.perf_counter() - start
+    report = cold_start_report()
+    if report["total"] > report["budget"]:
+        print("Cold start took %.2fs, over the %.2fs budget: %s" % (report["total"], report["budget"], report["phases"]))
+
+# Cold start phases so far, their total and the budget it is checked against (common.COLD_START_BUDGET)
+def cold_start_report():
+    return {"phases": dict(cold_start), "total": sum(cold_start.values()),
+            "budget": common.COLD_START_BUDGET, "lazy": common.LAZY_INIT and not common.PRELOAD_APP, "dataset_loaded": dataset_loaded}
 
 #----------------------------------------------------------------------#
 #--------------------------COMPOSER TRENDS-----------------------------#
 #----------------------------------------------------------------------#
-# Function to update comp_freq with data from specific year_range
-def update_freq(composer, composer_trends, composer_freq, curr_year):
-    if composer in composer_trends:
-        years, freqs = composer_trends[composer]
-        # first entry in trend
-        if len(years) == 0:
-            years.append(curr_year - 1)
-            freqs.append(0)
-            years.append(curr_year)
-            freqs.append(1)
-        # already added this year
-        elif years[-1] == curr_year:
-            freqs[-1] += 1
-        # add this year for the first time
-        else:
-            years.append(curr_year)
-            freqs.append(freqs[-1] + 1)
-
-    if composer in composer_freq:
-        composer_freq[composer] += 1
-
-# Return animation figure of total concert programming counts based off of tuning parameter
+# Cumulative line of an entity up to frame k: starts at zero the year before it was first programmed,
+# then has a point at every frame it was programmed in
+def cumulative_trend(windows, totals, row, frame_years, k):
+    played = np.flatnonzero(windows[row, :k + 1])
+    if len(played) == 0:
+        return [], []
+    return ([int(frame_years[played[0]]) - 1] + frame_years[played].tolist(),
+            [0] + totals[row, played].tolist())
+
+# Kagi line of an entity up to frame k: a vertical jump at every frame it was programmed in
+def kagi_trend(windows, row, frame_years, k):
+    played = np.flatnonzero(windows[row, :k + 1])
+    if len(played) == 0:
+        return [], []
+    counts = windows[row, played]
+    previous = np.concatenate(([0], counts[:-1]))
+    return ([int(frame_years[played[0]]) - 1] + np.repeat(frame_years[played], 2).tolist(),
+            [0] + np.column_stack((previous, counts)).ravel().tolist())
+
+# Top_N rows of every frame, best first, ranked by values (entities x frames).
+# Without a selection (rows is None) this is a slice of the precomputed rank table for the year_range.
+def frame_ranking(key, values, rows, top_N):
+    if rows is None:
+        ranks = rank_index.get(key)
+        if ranks is None or top_N > aggregates.MAX_TOP_N:
+            ranks = np.array([aggregates.top_entities(values[:, k], top_N) for k in range(values.shape[1])])
+        return ranks[:, :top_N]
+    return np.array([rows[np.argsort(-values[rows, k], kind="stable")[:top_N]] for k in range(values.shape[1])], dtype=int)
+
+# Animation frames that share their trace data: every entity that is ever on screen has its whole trend
+# sent once, and each frame lists [trend index, number of points shown] for its traces. The trend up to
+# a frame is always a prefix of the whole trend, so assets/frames.js rebuilds the plotly frames in the
+# browser by slicing, and the payload grows linearly with the number of frames instead of quadratically.
+# points = points added to a trend by every frame the entity is programmed in (1 cumulative, 2 kagi)
+def encode_frames(ranking, windows, trend, points, names, years):
+    rows, traces = np.unique(ranking, return_inverse=True)
+    traces = traces.reshape(ranking.shape)
+    played = np.cumsum(windows[rows] > 0, axis=1)
+    shown = np.where(played > 0, 1 + points * played, 0)
+    trends = {"x": [], "y": [], "name": names[rows].tolist()}
+    for row in rows:
+        x, y = trend(row)
+        trends["x"].append(x)
+        trends["y"].append(y)
+    frames = [{"name": str(year), "traces": np.column_stack((traces[k], shown[traces[k], k])).tolist()}
+              for k, year in enumerate(years)]
+    return trends, frames
+
+# Count matrix rows of the selected composers, None for all composers
+def composer_rows(composers):
+    if composers is None:
+        return None
+    return np.array([composer_index[composer] for composer in composers], dtype=int)
+
+# Count matrix for the chosen counting mode
+def composer_count_matrix(uniq_conc):
+    return uniq_composer_counts if uniq_conc else composer_counts
+
+# Return animation figure (frames encoded as in encode_frames) of total concert programming counts based off of tuning parameter
 # year_range = adjust specificity of animation using period of frames
 # top_N = number of top composers to display on graph
+@figure_cache.cached(fig_cache, figure_dependencies)
 def create_overall_fig(year_range = 5, top_N = 10, selected_composers = None, markers = False, uniq_conc = False):
+    load_dataset()
     fig_dict = {"data": [], "layout": {}, "frames": []}
-    fig_dict["data"] = [go.Scatter(x=[0], y=[0], mode="lines", name=i+1, showlegend=True) for i in range(top_N)]
+    fig_dict["data"] = [{"type": "scatter", "x": [0], "y": [0], "mode": "lines", "name": str(i+1), "showlegend": True} for i in range(top_N)]
 
     # Fill in layout
-    years = np.append(np.arange(start_year, end_year, step=year_range), end_year)
+    years = aggregates.frame_years(year_range)
+    fig_dict["layout"]["template"] = template
     fig_dict["layout"]["xaxis"] = {"range": [start_year, end_year], "title": "Year", "tickvals": years}
     fig_dict["layout"]["yaxis"] = {"range": [0, 6000], "title": "Popularity (Cumulative Times Programmed)"}
     # Set up play/pause buttons
@@ -103,45 +224,19 @@ def create_overall_fig(year_range = 5, top_N = 10, selected_composers = None, ma
         "steps": []
     }
 
-    composers = uniq_composers if selected_composers==None else selected_composers
-    # Make frames
-    composer_freq = pd.Series(np.zeros(len(composers)), dtype=int, index=composers) # create composer frequency from zero
-    # TODO: simplify this bc years list is not needed since we're generatin data at same time
-    composer_trends = {composer: ([], []) for composer in composers}
+    rows = composer_rows(selected_composers)
+    # Make frames from the counts per frame and running totals of every composer
+    windows, totals = aggregates.frame_counts(composer_count_matrix(uniq_conc), years[1:], start_year)
+    counting = "unique_count" if uniq_conc else "count"
+    ranking = frame_ranking(("composer", counting, "cumulative", year_range), totals, rows, top_N)
+    # Whole trend of every top_N composer, frame k shows it up to frame k
+    trend = lambda row: cumulative_trend(windows, totals, row, years[1:], len(years) - 2)
+    fig_dict["trends"], fig_dict["frames"] = encode_frames(ranking, windows, trend, 1, uniq_composers, years[1:])
+    fig_dict["mode"] = 'lines+markers' if markers else 'lines'
     for i, year in enumerate(years):
         if i == 0:
             continue
 
-        frame = {"data": [], "name": str(year)}
-        for y in range(years[i - 1], year + 1):
-            # Loop through all works in this year and update composer
-            if y in works_by_year.groups:
-                if not uniq_conc:
-                    works_by_year.get_group(y)['composer'].apply(update_freq, args=(composer_trends, composer_freq, year))
-                else:
-                    year_df = works_by_year.get_group(y)
-                    # Group by programId, then get unique composers per program
-                    composers_in_year = year_df.groupby('programID')['composer'].unique()
-                    
-                    # Flatten list of unique composers for the whole year
-                    unique_composers = pd.Series(np.concatenate(composers_in_year.values))
-
-                    unique_composers.apply(update_freq, args=(composer_trends, composer_freq, year))
-
-    
-        # Get top_N composers
-        top_composers = composer_freq.nlargest(top_N)
-
-        # Update line data
-        frame["data"] = [go.Scatter(x=composer_trends[composer][0], 
-                                    y=composer_trends[composer][1],
-                                    mode='lines+markers' if markers else 'lines',
-                                    name=composer,
-                                    showlegend=True)
-                                    for composer in top_composers.index]
-
-        fig_dict["frames"].append(frame)
-
         # Update step association for slider
         slider_step = {"args": [
                 [year],
@@ -158,39 +253,20 @@ def create_overall_fig(year_range = 5, top_N = 10, selected_composers = None, ma
 
     #fig_dict["layout"]["yaxis"] = {"range": [0, max(100, int(composer_freq.nlargest(1).iloc[0] * 1.1)]), "title": "Popularity (Times Programmed)"}
 
-    return go.Figure(fig_dict)
-
-
-
-# Update function for frequency of Kagi chart
-def update_kagi_freq(composer, composer_trends, curr_year):
-    if composer in composer_trends:
-        years, freqs = composer_trends[composer]
-        # first entry in trend
-        if len(years) == 0:
-            years.append(curr_year - 1)
-            freqs.append(0)
-            years.append(curr_year) # kagi vertical line
-            freqs.append(0) # kagi vertical line
-            years.append(curr_year)
-            freqs.append(1)
-        # already added this year
-        elif years[-1] == curr_year:
-            freqs[-1] += 1
-        # add this year for the first time
-        else:
-            years.append(curr_year)
-            freqs.append(freqs[-1])
-            years.append(curr_year)
-            freqs.append(1)
-
-# Return animation figure of popularity PER YEAR
+    return fig_dict
+
+
+
+# Return animation figure (frames encoded as in encode_frames) of popularity PER YEAR
+@figure_cache.cached(fig_cache, figure_dependencies)
 def create_pop_by_year_fig(year_range = 5, top_N = 10, selected_composers = None, markers = False, uniq_conc = False):
+    load_dataset()
     fig_dict = {"data": [], "layout": {}, "frames": []}
-    fig_dict["data"] = [go.Scatter(x=[0], y=[0], mode="lines", name=i, showlegend=True) for i in range(top_N)]
+    fig_dict["data"] = [{"type": "scatter", "x": [0], "y": [0], "mode": "lines", "name": str(i), "showlegend": True} for i in range(top_N)]
 
     # Fill in layout
-    years = np.append(np.arange(start_year, end_year, step=year_range), end_year)
+    years = aggregates.frame_years(year_range)
+    fig_dict["layout"]["template"] = template
     fig_dict["layout"]["xaxis"] = {"range": [start_year, end_year], "title": "Year", "tickvals": years}
     fig_dict["layout"]["yaxis"] = {"range": [0, 1000], "title": "Popularity (Times Programmed Per Year)"}
     # Set up play/pause buttons
@@ -241,48 +317,19 @@ def create_pop_by_year_fig(year_range = 5, top_N = 10, selected_composers = None
         "steps": []
     }
 
-    composers = uniq_composers if selected_composers==None else selected_composers
-    # Make frames
-    #composer_freq = pd.Series(np.zeros(len(composers)), dtype=int, index=composers) # create composer frequency from zero
-    # TODO: simplify this bc years list is not needed since we're generatin data at same time
-    composer_trends = {composer: ([], []) for composer in composers}
+    rows = composer_rows(selected_composers)
+    # Make frames from the counts per frame of every composer
+    windows, totals = aggregates.frame_counts(composer_count_matrix(uniq_conc), years[1:], start_year)
+    counting = "unique_count" if uniq_conc else "count"
+    ranking = frame_ranking(("composer", counting, "per_year", year_range), windows, rows, top_N)
+    # Whole trend of every top_N composer, frame k shows it up to frame k
+    trend = lambda row: kagi_trend(windows, row, years[1:], len(years) - 2)
+    fig_dict["trends"], fig_dict["frames"] = encode_frames(ranking, windows, trend, 2, uniq_composers, years[1:])
+    fig_dict["mode"] = 'lines+markers' if markers else 'lines'
     for i, year in enumerate(years):
         if i == 0:
             continue
 
-        frame = {"data": [], "name": str(year)}
-        for y in range(years[i - 1], year + 1):
-            # Loop through all works in this year and update composer
-            if y in works_by_year.groups:
-                if not uniq_conc:
-                    works_by_year.get_group(y)['composer'].apply(update_kagi_freq, args=(composer_trends, year))
-                else:
-                    year_df = works_by_year.get_group(y)
-                    # Group by programId, then get unique composers per program
-                    composers_in_year = year_df.groupby('programID')['composer'].unique()
-                    
-                    # Flatten list of unique composers for the whole year
-                    unique_composers = pd.Series(np.concatenate(composers_in_year.values))
-
-                    unique_composers.apply(update_kagi_freq, args=(composer_trends, year))
-    
-        # Get top_N composers
-        composer_freq = {
-            composer: freqs[-1] if len(freqs) > 0 and years[-1] == year else 0
-            for composer, (years, freqs) in composer_trends.items()
-        }
-        top_composers = sorted(composer_freq, key=composer_freq.get, reverse=True)[:top_N]
-
-        # Update line data
-        frame["data"] = [go.Scatter(x=composer_trends[composer][0], 
-                                    y=composer_trends[composer][1],
-                                    mode='lines+markers' if markers else 'lines',
-                                    name=composer,
-                                    showlegend=True)
-                                    for composer in top_composers]
-
-        fig_dict["frames"].append(frame)
-
         # Update step association for slider
         slider_step = {"args": [
                 [year],
@@ -299,42 +346,34 @@ def create_pop_by_year_fig(year_range = 5, top_N = 10, selected_composers = None
 
     #fig_dict["layout"]["yaxis"] = {"range": [0, max(100, int(composer_freq.nlargest(1).iloc[0] * 1.1)]), "title": "Popularity (Times Programmed)"}
 
-    return go.Figure(fig_dict)
+    return fig_dict
 
 
 #----------------------------------------------------------------------#
 #----------------------------WORK TRENDS-------------------------------#
 #----------------------------------------------------------------------#
-# Function to update comp_freq with data from specific year_range
-def update_work_freq(work_title, work_trends, work_freq, curr_year):
-    if work_title in work_trends:
-        years, freqs = work_trends[work_title]
-        # first entry in trend
-        if len(years) == 0:
-            years.append(curr_year - 1)
-            freqs.append(0)
-            years.append(curr_year)
-            freqs.append(1)
-        # already added this year
-        elif years[-1] == curr_year:
-            freqs[-1] += 1
-        # add this year for the first time
-        else:
-            years.append(curr_year)
-            freqs.append(freqs[-1] + 1)
-
-    if work_title in work_freq:
-        work_freq[work_title] += 1
-
-# Return animation figure of total concert programming counts based off of tuning parameter
+# Count matrix rows (work IDs) of the works selected by their dropdown key, None for all works
+def work_rows(works_list):
+    if works_list is None:
+        return None
+    return np.array([work_index[work] for work in works_list], dtype=int)
+
+# Count matrix and its name in the rank index for the chosen counting mode
+def work_count_matrix(collapse):
+    return (work_collapsed_counts, "collapsed_count") if collapse else (work_counts, "count")
+
+# Return animation figure (frames encoded as in encode_frames) of total concert programming counts based off of tuning parameter
 # year_range = adjust specificity of animation using period of frames
 # top_N = number of top composers to display on graph
-def create_overall_work_fig(year_range = 5, top_N = 10, selected_works = None, markers = False):
+@figure_cache.cached(fig_cache, figure_dependencies)
+def create_overall_work_fig(year_range = 5, top_N = 10, selected_works = None, markers = False, collapse = False):
+    load_dataset()
     fig_dict = {"data": [], "layout": {}, "frames": []}
-    fig_dict["data"] = [go.Scatter(x=[0], y=[0], mode="lines", name=i, showlegend=True) for i in range(top_N)]
+    fig_dict["data"] = [{"type": "scatter", "x": [0], "y": [0], "mode": "lines", "name": str(i), "showlegend": True} for i in range(top_N)]
 
     # Fill in layout
-    years = np.append(np.arange(start_year, end_year, step=year_range), end_year)
+    years = aggregates.frame_years(year_range)
+    fig_dict["layout"]["template"] = template
     fig_dict["layout"]["xaxis"] = {"range": [start_year, end_year], "title": "Year", "tickvals": years}
     fig_dict["layout"]["yaxis"] = {"range": [0, 2000], "title": "Popularity (Cumulative Times Programmed)"}
     # Set up play/pause buttons
@@ -385,34 +424,19 @@ def create_overall_work_fig(year_range = 5, top_N = 10, selected_works = None, m
         "steps": []
     }
 
-    works_list = uniq_works if selected_works==None else selected_works
-    # Make frames
-    work_freq = pd.Series(np.zeros(len(works_list)), dtype=int, index=works_list) # create work frequency from zero
-    # TODO: simplify this bc years list is not needed since we're generating data at same time
-    work_trends = {work: ([], []) for work in works_list}
+    rows = work_rows(selected_works)
+    # Make frames from the counts per frame and running totals of every work
+    counts, counting = work_count_matrix(collapse)
+    windows, totals = aggregates.frame_counts(counts, years[1:], start_year)
+    ranking = frame_ranking(("work", counting, "cumulative", year_range), totals, rows, top_N)
+    # Whole trend of every top_N work, frame k shows it up to frame k
+    trend = lambda row: cumulative_trend(windows, totals, row, years[1:], len(years) - 2)
+    fig_dict["trends"], fig_dict["frames"] = encode_frames(ranking, windows, trend, 1, work_labels, years[1:])
+    fig_dict["mode"] = 'lines+markers' if markers else 'lines'
     for i, year in enumerate(years):
         if i == 0:
             continue
 
-        frame = {"data": [], "name": str(year)}
-        for y in range(years[i - 1], year + 1):
-            # Loop through all works in this year and update composer
-            if y in works_by_year.groups:
-                works_by_year.get_group(y)['title'].apply(update_work_freq, args=(work_trends, work_freq, year))
-    
-        # Get top_N composers
-        top_works = work_freq.nlargest(top_N)
-
-        # Update line data
-        frame["data"] = [go.Scatter(x=work_trends[work][0], 
-                                    y=work_trends[work][1],
-                                    mode='lines+markers' if markers else 'lines',
-                                    name=work + " - " + works[works.title == work].iloc[0]["composer"],
-                                    showlegend=True)
-                                    for work in top_works.index]
-
-        fig_dict["frames"].append(frame)
-
         # Update step association for slider
         slider_step = {"args": [
                 [year],
@@ -429,37 +453,18 @@ def create_overall_work_fig(year_range = 5, top_N = 10, selected_works = None, m
 
     #fig_dict["layout"]["yaxis"] = {"range": [0, max(100, int(composer_freq.nlargest(1).iloc[0] * 1.1)]), "title": "Popularity (Times Programmed)"}
 
-    return go.Figure(fig_dict)
-
-# Update function for frequency of Kagi chart
-def update_work_kagi_freq(work, work_trends, curr_year):
-    if work in work_trends:
-        years, freqs = work_trends[work]
-        # first entry in trend
-        if len(years) == 0:
-            years.append(curr_year - 1)
-            freqs.append(0)
-            years.append(curr_year) # kagi vertical line
-            freqs.append(0) # kagi vertical line
-            years.append(curr_year)
-            freqs.append(1)
-        # already added this year
-        elif years[-1] == curr_year:
-            freqs[-1] += 1
-        # add this year for the first time
-        else:
-            years.append(curr_year)
-            freqs.append(freqs[-1])
-            years.append(curr_year)
-            freqs.append(1)
-
-# Return animation figure of popularity PER YEAR
-def create_work_pop_by_year_fig(year_range = 5, top_N = 10, selected_works = None, markers = False):
+    return fig_dict
+
+# Return animation figure (frames encoded as in encode_frames) of popularity PER YEAR
+@figure_cache.cached(fig_cache, figure_dependencies)
+def create_work_pop_by_year_fig(year_range = 5, top_N = 10, selected_works = None, markers = False, collapse = False):
+    load_dataset()
     fig_dict = {"data": [], "layout": {}, "frames": []}
-    fig_dict["data"] = [go.Scatter(x=[0], y=[0], mode="lines", name=i, showlegend=True) for i in range(top_N)]
+    fig_dict["data"] = [{"type": "scatter", "x": [0], "y": [0], "mode": "lines", "name": str(i), "showlegend": True} for i in range(top_N)]
 
     # Fill in layout
-    years = np.append(np.arange(start_year, end_year, step=year_range), end_year)
+    years = aggregates.frame_years(year_range)
+    fig_dict["layout"]["template"] = template
     fig_dict["layout"]["xaxis"] = {"range": [start_year, end_year], "title": "Year", "tickvals": years}
     fig_dict["layout"]["yaxis"] = {"range": [0, 200], "title": "Popularity (Times Programmed Per Year)"}
     # Set up play/pause buttons
@@ -510,38 +515,19 @@ def create_work_pop_by_year_fig(year_range = 5, top_N = 10, selected_works = Non
         "steps": []
     }
 
-    works_list = uniq_works if selected_works==None else selected_works
-    # Make frames
-    #composer_freq = pd.Series(np.zeros(len(composers)), dtype=int, index=composers) # create composer frequency from zero
-    # TODO: simplify this bc years list is not needed since we're generatin data at same time
-    work_trends = {work: ([], []) for work in works_list}
+    rows = work_rows(selected_works)
+    # Make frames from the counts per frame of every work
+    counts, counting = work_count_matrix(collapse)
+    windows, totals = aggregates.frame_counts(counts, years[1:], start_year)
+    ranking = frame_ranking(("work", counting, "per_year", year_range), windows, rows, top_N)
+    # Whole trend of every top_N work, frame k shows it up to frame k
+    trend = lambda row: kagi_trend(windows, row, years[1:], len(years) - 2)
+    fig_dict["trends"], fig_dict["frames"] = encode_frames(ranking, windows, trend, 2, work_labels, years[1:])
+    fig_dict["mode"] = 'lines+markers' if markers else 'lines'
     for i, year in enumerate(years):
         if i == 0:
             continue
 
-        frame = {"data": [], "name": str(year)}
-        for y in range(years[i - 1], year + 1):
-            # Loop through all works in this year and update composer
-            if y in works_by_year.groups:
-                works_by_year.get_group(y)['title'].apply(update_work_kagi_freq, args=(work_trends, year))
-    
-        # Get top_N composers
-        work_freq = {
-            work: freqs[-1] if len(freqs) > 0 and years[-1] == year else 0
-            for work, (years, freqs) in work_trends.items()
-        }
-        top_works = sorted(work_freq, key=work_freq.get, reverse=True)[:top_N]
-
-        # Update line data
-        frame["data"] = [go.Scatter(x=work_trends[work][0], 
-                                    y=work_trends[work][1],
-                                    mode='lines+markers' if markers else 'lines',
-                                    name=work + " - " + works[works.title == work].iloc[0]["composer"],
-                                    showlegend=True)
-                                    for work in top_works]
-
-        fig_dict["frames"].append(frame)
-
         # Update step association for slider
         slider_step = {"args": [
                 [year],
@@ -558,15 +544,239 @@ def create_work_pop_by_year_fig(year_range = 5, top_N = 10, selected_works = Non
 
     #fig_dict["layout"]["yaxis"] = {"range": [0, max(100, int(composer_freq.nlargest(1).iloc[0] * 1.1)]), "title": "Popularity (Times Programmed)"}
 
-    return go.Figure(fig_dict)
+    return fig_dict
 
 #----------------------------------------------------------------------#
 #----------------------------APP LAYOUT--------------------------------#
 #----------------------------------------------------------------------#
 
-app = Dash(__name__, suppress_callback_exceptions=True)
+# Figure callbacks run as background jobs in their own processes, queued in a diskcache folder, so a web worker
+# never builds a figure. Without diskcache they run in the request like any other callback.
+background_manager = jobs.JobManager(diskcache.Cache(common.JOB_CACHE_DIR)) if diskcache else None
+
+app = Dash(__name__, suppress_callback_exceptions=True, compress=True, background_callback_manager=background_manager)
 server = app.server
 
+figure_builders = {builder.__name__: builder for builder in
+                   [create_overall_fig, create_pop_by_year_fig, create_overall_work_fig, create_work_pop_by_year_fig]}
+
+# URL the browser fetches a figure from, see send_figure
+def figure_url(builder, **params):
+    query = urllib.parse.urlencode({"params": json.dumps(params, sort_keys=True)})
+    return app.get_relative_path("/figures/" + builder.__name__ + "?" + query)
+
+# Why the parameters of a figure request are not ones the UI can ask for, None if they are. Anything else gets
+# a 400, rather than an error in the builder or a made up figure built into the shared disk cache.
+def figure_params_error(builder, params):
+    if not isinstance(params, dict):
+        return "params must be a JSON object"
+    try:
+        bound = inspect.signature(builder.uncached).bind(**params)
+    except TypeError as error:
+        return str(error)
+    bound.apply_defaults()
+    arguments = bound.arguments
+    if type(arguments["year_range"]) is not int or arguments["year_range"] not in aggregates.YEAR_RANGES:
+        return "year_range must be one of " + ", ".join(map(str, aggregates.YEAR_RANGES))
+    selection_name = "selected_composers" if "selected_composers" in arguments else "selected_works"
+    selection = arguments[selection_name]
+    limit = aggregates.MAX_TOP_N if selection is None else common.MAX_SELECTION
+    if type(arguments["top_N"]) is not int or not 1 <= arguments["top_N"] <= limit:
+        return "top_N must be between 1 and %d" % limit
+    if selection is not None:
+        load_dataset()
+        index = composer_index if selection_name == "selected_composers" else work_index
+        if not isinstance(selection, list) or not 1 <= len(selection) <= common.MAX_SELECTION:
+            return "%s must be a list of 1 to %d names" % (selection_name, common.MAX_SELECTION)
+        unknown = [name for name in selection if not isinstance(name, str) or name not in index]
+        if unknown:
+            return "unknown names in %s: %s" % (selection_name, ", ".join(map(str, unknown[:5])))
+    for flag in ["markers", "uniq_conc", "collapse"]:
+        if flag in arguments and not isinstance(arguments[flag], bool):
+            return flag + " must be true or false"
+    return None
+
+# Send a figure already serialised and compressed in the best encoding the browser accepts.
+# The ETag is the cache key (figure parameters + dataset version) so a figure the browser
+# already has costs a 304, and new data changes the ETag.
+@server.route("/figures/<name>")
+def send_figure(name):
+    if name not in figure_builders:
+        api_error("unknown figure", 404)
+    builder = figure_builders[name]
+    try:
+        params = json.loads(request.args.get("params", "{}"))
+    except ValueError:
+        api_error("params must be JSON")
+    error = figure_params_error(builder, params)
+    if error:
+        api_error(error)
+    key = builder.key(**params)
+    encoding = figure_cache.negotiate(request.headers.get("Accept-Encoding"))
+    etag = key + "-" + encoding
+    headers = {"ETag": '"' + etag + '"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+    # With background jobs the browser only gets the URL of a figure once it is built (see build_figure), so a web
+    # worker only builds the default figures of the tabs, and only if they were evicted since they were built
+    if background_manager is not None and params and not fig_cache.has(key):
+        api_error("figure not built", 404)
+
+    # The Content-Encoding header is set even for identity, so Dash's response compression (which takes a q=0
+    # encoding for an accepted one) leaves the figure as negotiated
+    headers["Content-Encoding"] = encoding
+    return Response(builder(encoding=encoding, **params), mimetype="application/json", headers=headers)
+
+#----------------------------------------------------------------------#
+#-----------------------------DATA API---------------------------------#
+#----------------------------------------------------------------------#
+# How many times composers or works were programmed between two years, for scripts instead of screenshots:
+#   GET  /api/counts?entity=composer&name=Brahms, Johannes&start=1900&end=1950&unique=1&format=csv
+#   POST /api/counts {"entity": "work", "queries": [{"name": "Beethoven, Ludwig van: SYMPHONY NO. 5", "start": 1900, "end": 1950}, ...]}
+# name can be given many times, and each query of a POST has its own years. Years are inclusive and default
+# to the whole archive; unique=1 counts each composer once per concert and collapse=1 each work once per concert
+# however many of its movements are listed. performances=1 counts every performance of a program (in the year it
+# was given), not just the program. Names are as in /api/names, work
+# names being "composer: title"; a name the API does not know gets a null count and an error. Bad requests
+# get a 400 with a JSON {"error": ...} body, as do bad figure requests. Every count is one subtraction of precomputed prefix sums.
+def api_error(message, status=400):
+    abort(Response(json.dumps({"error": message}), status=status, mimetype="application/json"))
+
+def api_entity(entity):
+    if entity == "composer":
+        return composer_index
+    if entity == "work":
+        return work_index
+    api_error("entity must be composer or work")
+
+# A year from the query string (text) or a JSON body (a number, which must be whole and not a boolean)
+def api_year(value, default):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)) or (isinstance(value, float) and not value.is_integer()):
+        api_error("years must be integers")
+    try:
+        return int(np.int32(int(value)))
+    except (ValueError, OverflowError):
+        api_error("years must be integers")
+
+# Flags of the counts API choosing what is counted instead of every time a name is programmed
+api_countings = [("unique", "unique_count"), ("collapse", "collapsed_count"), ("performances", "performance_count")]
+
+def api_flag(value):
+    return value in (True, 1, "1", "true", "True", "yes")
+
+# Rows of a counts answer as JSON, or CSV with the same columns
+def api_response(rows, columns, format):
+    if format == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, columns, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        return Response(out.getvalue(), mimetype="text/csv")
+    if format not in (None, "", "json"):
+        api_error("format must be json or csv")
+    return Response(figure_cache.dumps({"results": rows}), mimetype="application/json")
+
+@server.route("/api/counts", methods=["GET", "POST"])
+def api_counts():
+    load_dataset()
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("queries"), list):
+            api_error("expected a JSON object with a list of queries")
+        options = body
+        queries = [query if isinstance(query, dict) else {"name": query} for query in body["queries"]]
+    else:
+        options = request.args
+        queries = [{"name": name, "start": options.get("start"), "end": options.get("end")} for name in request.args.getlist("name")]
+
+    entity = options.get("entity", "composer")
+    index = api_entity(entity)
+    countings = [counting for flag, counting in api_countings if api_flag(options.get(flag))]
+    if len(countings) > 1:
+        api_error("unique, collapse and performances are different counts, set at most one of them")
+    counting = countings[0] if countings else "count"
+    if (entity, counting) not in prefix_sums:
+        api_error("composers can be counted with unique or performances, works with collapse or performances")
+
+    names = [str(query.get("name")) for query in queries]
+    starts = np.array([api_year(query.get("start"), start_year) for query in queries], dtype=int)
+    ends = np.array([api_year(query.get("end"), end_year) for query in queries], dtype=int)
+    rows = np.array([index.get(name, -1) for name in names], dtype=int)
+    found = rows >= 0
+    counts = np.zeros(len(queries), dtype=int)
+    counts[found] = aggregates.range_counts(prefix_sums[(entity, counting)], rows[found], starts[found], ends[found])
+
+    results = [{"name": name, "start": int(start), "end": int(end), "count": int(count) if known else None,
+                "error": None if known else "unknown " + entity} for name, start, end, count, known in zip(names, starts, ends, counts, found)]
+    return api_response(results, ["name", "start", "end", "count", "error"], options.get("format"))
+
+# Every name the counts API knows for an entity, with its total count so the most programmed come first
+@server.route("/api/names")
+def api_names():
+    load_dataset()
+    entity = request.args.get("entity", "composer")
+    api_entity(entity)
+    prefix = prefix_sums[(entity, "count")]
+    names = uniq_composers if entity == "composer" else uniq_works
+    totals = prefix[:, -1]
+    order = np.argsort(-totals, kind="stable")
+    results = [{"name": names[row], "count": int(totals[row])} for row in order]
+    return api_response(results, ["name", "count"], request.args.get("format"))
+
+# Metrics labels of a request: the callback (by the output it updates, some callbacks share a name) or figure
+# it asks for, and its inputs for the slow request log
+def metrics_labels(request):
+    if request.path == "/_dash-update-component":
+        body = request.get_json(silent=True) or {}
+        output = body.get("output", "")
+        function = app.callback_map.get(output, {}).get("callback")
+        inputs = {item.get("id"): item.get("value") for item in body.get("inputs", []) if isinstance(item, dict)}
+        return ("callback", getattr(function, "__name__", "unknown"), output), inputs
+    if request.url_rule is not None and request.url_rule.rule == "/figures/<name>":
+        name = request.view_args["name"]
+        return ("figure", name if name in figure_builders else "unknown", ""), request.args.get("params")
+    return ("other", request.url_rule.rule if request.url_rule is not None else "unmatched", ""), None
+
+request_metrics = metrics.Metrics(common.METRICS_DIR, common.SLOW_REQUEST_SECONDS, fig_cache)
+request_metrics.install(server, metrics_labels)
+
+# Outputs of a tuning callback for a figure: its URL for the graph's frames store when it is in the cache (or
+# without background jobs, when send_figure builds it) and no build request, otherwise a build request for the
+# graph's request store
+def build_figure(builder, **params):
+    if background_manager is None or fig_cache.has(builder.key(**params)):
+        return figure_url(builder, **params), None
+    return no_update, {"builder": builder.__name__, "params": params}
+
+# Outputs of the tuning callback of a graph: its frames store and its request store
+def tuning_outputs(graph):
+    return [Output(component_id = graph + '-frames', component_property = 'data'),
+            Output(component_id = graph + '-request', component_property = 'data')]
+
+# Background callback of a graph building a figure its tuning callback did not find in the cache, in a process of
+# its own so no web worker builds it. A status line shows while it runs. The browser holds a build request back
+# until the tuners have not changed for common.FIGURE_DEBOUNCE_MS (assets/frames.js), so clicking through a
+# dropdown starts one job and not one per click. Any newer tuning of the graph cancels a running job, as does a
+# tab switch, which removes the graph.
+def build_callback(graph):
+    clientside_callback(ClientsideFunction(namespace='frames', function_name='debounce'),
+                        Output(graph + '-pending', 'data'), Input(graph + '-request', 'data'), State('figure-debounce-ms', 'data'))
+
+    @callback(Output(graph + '-frames', 'data', allow_duplicate=True), Input(graph + '-pending', 'data'),
+              running=[(Output(graph + '-status', 'children'), "Updating figure...", "")], background=True,
+              interval=common.JOB_POLL_MS, cancel=[Input('graph-tabs', 'value'), Input(graph + '-request', 'data')],
+              prevent_initial_call=True)
+    def build_pending_figure(pending):
+        builder = figure_builders[pending["builder"]]
+        builder(**pending["params"])
+        return figure_url(builder, **pending["params"])
+
+if background_manager is not None:
+    for graph in ['composer-line', 'composer-kagi', 'work-line', 'work-kagi']:
+        build_callback(graph)
+
 app.layout = [
     # Header
     html.H1("Is Mozart Really That Popular?", style={'textAlign':'center'}),
@@ -579,6 +789,8 @@ app.layout = [
         dcc.Tab(label='Work Trends', value='work-popularity-tab'),
     ]),
     html.Div(id='tab-content'),
+    # How long the browser waits before starting a background figure job, see build_callback
+    dcc.Store(id='figure-debounce-ms', data=common.FIGURE_DEBOUNCE_MS),
     # Separator
     #html.Div(style={'clear': 'both', 'margin-bottom': '5%'}), 
 
@@ -587,69 +799,105 @@ app.layout = [
 
 # Callback function to update tuning parameters of the cumulative graph
 @callback(
-    output=Output(component_id = 'composer-line-graph', component_property = 'figure'),
+    output=tuning_outputs('composer-line'),
     inputs=dict(year_range = Input(component_id='cu-year-range-selector', component_property='value'),
                 top_N = Input(component_id='cu-top-N-selector', component_property='value'),
                 composers = Input(component_id='cu-composers-selector', component_property='value'),
-                markers = Input(component_id='cu-markers-selector', component_property='value'))
+                markers = Input(component_id='cu-markers-selector', component_property='value')),
+    prevent_initial_call=True
 )
 def update_cu_composer_graph(year_range, top_N, composers, markers):
     marker = False if markers == None or 'Markers?' not in markers else True
     uniq = False if markers == None or 'Unique Per Concert?' not in markers else True
-    if composers == None:
-        return create_overall_fig(year_range, top_N, markers=marker, uniq_conc=uniq)
+    if not composers:
+        return build_figure(create_overall_fig, year_range=year_range, top_N=top_N, markers=marker, uniq_conc=uniq)
     else:
-        return create_overall_fig(year_range, top_N=len(composers), selected_composers=composers, markers=marker, uniq_conc=uniq)
+        return build_figure(create_overall_fig, year_range=year_range, top_N=len(composers[:common.MAX_SELECTION]), selected_composers=composers[:common.MAX_SELECTION], markers=marker, uniq_conc=uniq)
 
 # Callback function to update tuning parameters of the kagi graph
 @callback(
-    output=Output(component_id = 'composer-kagi-graph', component_property = 'figure'),
+    output=tuning_outputs('composer-kagi'),
     inputs=dict(year_range = Input(component_id='kagi-year-range-selector', component_property='value'),
                 top_N = Input(component_id='kagi-top-N-selector', component_property='value'),
                 composers = Input(component_id='kagi-composers-selector', component_property='value'),
-                markers = Input(component_id='kagi-markers-selector', component_property='value'))
+                markers = Input(component_id='kagi-markers-selector', component_property='value')),
+    prevent_initial_call=True
 )
 def update_kagi_composer_graph(year_range, top_N, composers, markers):
     marker = False if markers == None or 'Markers?' not in markers else True
     uniq = False if markers == None or 'Unique Per Concert?' not in markers else True
-    if composers == None:
-        return create_pop_by_year_fig(year_range, top_N, markers=marker, uniq_conc=uniq)
+    if not composers:
+        return build_figure(create_pop_by_year_fig, year_range=year_range, top_N=top_N, markers=marker, uniq_conc=uniq)
     else:
-        return create_pop_by_year_fig(year_range, top_N=len(composers), selected_composers=composers, markers=marker, uniq_conc=uniq)
+        return build_figure(create_pop_by_year_fig, year_range=year_range, top_N=len(composers[:common.MAX_SELECTION]), selected_composers=composers[:common.MAX_SELECTION], markers=marker, uniq_conc=uniq)
 
 # Callback function to update tuning parameters of the cumulative work graph
 @callback(
-    output=Output(component_id = 'work-line-graph', component_property = 'figure'),
+    output=tuning_outputs('work-line'),
     inputs=dict(year_range = Input(component_id='cu-work-year-range-selector', component_property='value'),
                 top_N = Input(component_id='cu-work-top-N-selector', component_property='value'),
                 works = Input(component_id='cu-works-selector', component_property='value'),
-                markers = Input(component_id='cu-works-markers-selector', component_property='value'))
+                markers = Input(component_id='cu-works-markers-selector', component_property='value')),
+    prevent_initial_call=True
 )
 def update_cu_composer_graph(year_range, top_N, works, markers):
-    if works == None:
-        return create_overall_work_fig(year_range, top_N, markers=False if markers == None else True)
+    marker = False if markers == None or 'Markers?' not in markers else True
+    collapse = False if markers == None or 'Collapse Movements?' not in markers else True
+    if not works:
+        return build_figure(create_overall_work_fig, year_range=year_range, top_N=top_N, markers=marker, collapse=collapse)
     else:
-        return create_overall_work_fig(year_range, top_N=len(works), selected_works=works, markers=False if markers == None else True)
+        return build_figure(create_overall_work_fig, year_range=year_range, top_N=len(works[:common.MAX_SELECTION]), selected_works=works[:common.MAX_SELECTION], markers=marker, collapse=collapse)
 
 # Callback function to update tuning parameters of the kagi work graph
 @callback(
-    output=Output(component_id = 'work-kagi-graph', component_property = 'figure'),
+    output=tuning_outputs('work-kagi'),
     inputs=dict(year_range = Input(component_id='work-kagi-year-range-selector', component_property='value'),
                 top_N = Input(component_id='work-kagi-top-N-selector', component_property='value'),
                 works = Input(component_id='kagi-works-selector', component_property='value'),
-                markers = Input(component_id='work-kagi-markers-selector', component_property='value'))
+                markers = Input(component_id='work-kagi-markers-selector', component_property='value')),
+    prevent_initial_call=True
 )
 def update_kagi_composer_graph(year_range, top_N, works, markers):
-    if works == None:
-        return create_work_pop_by_year_fig(year_range, top_N, markers=False if markers == None else True)
+    marker = False if markers == None or 'Markers?' not in markers else True
+    collapse = False if markers == None or 'Collapse Movements?' not in markers else True
+    if not works:
+        return build_figure(create_work_pop_by_year_fig, year_range=year_range, top_N=top_N, markers=marker, collapse=collapse)
     else:
-        return create_work_pop_by_year_fig(year_range, top_N=len(works), selected_works=works, markers=False if markers == None else True)
-
+        return build_figure(create_work_pop_by_year_fig, year_range=year_range, top_N=len(works[:common.MAX_SELECTION]), selected_works=works[:common.MAX_SELECTION], markers=marker, collapse=collapse)
+
+# Fetch the figure of every graph and rebuild its animation frames in the browser (assets/frames.js),
+# or leave the graph as it is and show why in its status line
+for graph in ['composer-line', 'composer-kagi', 'work-line', 'work-kagi']:
+    clientside_callback(ClientsideFunction(namespace='frames', function_name='decode'),
+                        [Output(component_id = graph + '-graph', component_property = 'figure'),
+                         Output(component_id = graph + '-status', component_property = 'children')],
+                        Input(component_id = graph + '-frames', component_property = 'data'))
+
+# Callback functions to search the composer and work filters on the server: the dropdowns start with the most
+# programmed names and get the best matches of what is typed, instead of every name in the layout
+def search_callback(dropdown, get_index):
+    @callback(Output(dropdown, 'options'), Input(dropdown, 'search_value'), State(dropdown, 'value'), prevent_initial_call=True)
+    def update_options(search_value, selected):
+        load_dataset()
+        return search.dropdown_options(get_index(), search_value, selected, common.SEARCH_RESULTS)
+
+for dropdown in ['cu-composers-selector', 'kagi-composers-selector']:
+    search_callback(dropdown, lambda: composer_search)
+for dropdown in ['cu-works-selector', 'kagi-works-selector']:
+    search_callback(dropdown, lambda: work_search)
 
 # Callback function for rendering various tabs
 @callback(Output('tab-content', 'children'), 
           Input('graph-tabs', 'value'))
 def render_tab(tab):
+    return tab_layout(tab)
+
+# Layout of a tab, built once per process (so once per dataset version) and shared by every session.
+# The graphs get the URL of their default figure, which is built once and cached for every worker,
+# and the tuning callbacks only fire when a tuner changes, so a tab switch never builds a figure twice.
+@functools.lru_cache(maxsize=None)
+def tab_layout(tab):
+    # the home tab is static, so only the graph tabs wait for the dataset
     if tab == 'home-tab':
         return [dcc.Markdown('''
             ### About This Tool
@@ -682,10 +930,15 @@ def render_tab(tab):
             issues of overcounting that is caused by the way the database was chosen to be represented by
             the original creator. Checking this box will ensure that composers are counted ONLY ONCE per
             program/concert, yielding significantly different results in frequency. Users should use
-            this option however it aligns with their research interests.
+            this option however it aligns with their research interests. Likewise, "Collapse Movements?" on the work
+            graphs counts a piece only once per concert when its movements are listed as separate works.
             5. **Export Results**  
             Download plots as pngs by clicking the camera icon in the top right corner of each graph.
-                         
+            The counts behind the plots are available as JSON or CSV: `/api/names?entity=composer` lists
+            every composer (or `entity=work`), and `/api/counts?entity=composer&name=...&start=1900&end=1950&unique=1&format=csv`
+            counts one or more of them (repeat `name`) between two years; add `performances=1` to count every
+            performance of a program rather than the program once.
+
             App is currently hosted on render with a very limited CPU. As such, when switching tabs there may be significant delays in loading the content for the time being.
             Render's workers will sometimes also run out of memory, causing the website to freeze. Apologies for the performance issues. 
             ''', style={'margin': '5%'}),
@@ -695,9 +948,10 @@ def render_tab(tab):
             ''', style={'margin': '5%'})
         ]
     elif tab == 'composer-popularity-tab':
+        load_dataset()
         return html.Div([
             html.H2(children='Composer Popularity Over Time', style={'textAlign':'center'}),
-            html.Div(dcc.Graph(figure=create_overall_fig(), id='composer-line-graph', style={'textAlign':'center'})),
+            html.Div([dcc.Store(data=figure_url(create_overall_fig), id='composer-line-frames'), dcc.Store(id='composer-line-request'), dcc.Store(id='composer-line-pending'), html.Div(id='composer-line-status', style={'textAlign':'center'}), dcc.Graph(id='composer-line-graph', style={'textAlign':'center'})]),
             html.Div([ # year_range and top_N tuners
                 html.Div([html.Label("Years Between Each Tick", htmlFor='cu-year-range-selector'),
                         dcc.Dropdown(options=[1,5,10,25], value=5, id='cu-year-range-selector')]),
@@ -706,7 +960,7 @@ def render_tab(tab):
             ], style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
             html.Div([ # composer filter and marker selector
                 html.Div([html.Label("Filter by composer", htmlFor='cu-composers-selector'),
-                        dcc.Dropdown(options=uniq_composers, id='cu-composers-selector', multi=True)]),
+                        dcc.Dropdown(options=search.dropdown_options(composer_search, '', None, common.SEARCH_RESULTS), id='cu-composers-selector', multi=True)]),
                 html.Div(dcc.Checklist(['Markers?', 'Unique Per Concert?'], id='cu-markers-selector'), style={'padding-top': 25}),
             ], style={'width': '45%', 'float': 'left', 'display': 'inline-block'}),
 
@@ -716,7 +970,7 @@ def render_tab(tab):
 
             # Kagi chart graph
             html.H2(children='Composer Popularity Per Year', style={'textAlign':'center'}),
-            html.Div([dcc.Graph(figure=create_pop_by_year_fig(), id='composer-kagi-graph')]),
+            html.Div([dcc.Store(data=figure_url(create_pop_by_year_fig), id='composer-kagi-frames'), dcc.Store(id='composer-kagi-request'), dcc.Store(id='composer-kagi-pending'), html.Div(id='composer-kagi-status', style={'textAlign':'center'}), dcc.Graph(id='composer-kagi-graph')]),
             html.Div([ # year_range and top_N tuners
                 html.Div([html.Label("Years Between Each Tick", htmlFor='kagi-year-range-selector'),
                         dcc.Dropdown(options=[1,5,10,25], value=5, id='kagi-year-range-selector')]),
@@ -725,13 +979,14 @@ def render_tab(tab):
             ], style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
             html.Div([ # composer filter and marker selector
                 html.Div([html.Label("Filter by composer", htmlFor='kagi-composers-selector'),
-                        dcc.Dropdown(options=uniq_composers, id='kagi-composers-selector', multi=True)]),
+                        dcc.Dropdown(options=search.dropdown_options(composer_search, '', None, common.SEARCH_RESULTS), id='kagi-composers-selector', multi=True)]),
                 html.Div(dcc.Checklist(['Markers?', 'Unique Per Concert?'], id='kagi-markers-selector'), style={'padding-top': 25})
             ], style={'width': '45%', 'float': 'left', 'display': 'inline-block'})])
     elif tab == 'work-popularity-tab':
+        load_dataset()
         return html.Div([
             html.H2(children='Work Popularity Over Time', style={'textAlign':'center'}),
-            html.Div(dcc.Graph(figure=create_overall_work_fig(), id='work-line-graph', style={'textAlign':'center'})),
+            html.Div([dcc.Store(data=figure_url(create_overall_work_fig), id='work-line-frames'), dcc.Store(id='work-line-request'), dcc.Store(id='work-line-pending'), html.Div(id='work-line-status', style={'textAlign':'center'}), dcc.Graph(id='work-line-graph', style={'textAlign':'center'})]),
 
             html.Div([ # year_range and top_N tuners
                 html.Div([html.Label("Years Between Each Tick", htmlFor='cu-work-year-range-selector'),
@@ -741,8 +996,8 @@ def render_tab(tab):
             ], style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
             html.Div([ # composer filter and marker selector
                 html.Div([html.Label("Filter by work", htmlFor='cu-works-selector'),
-                        dcc.Dropdown(options=uniq_works_with_composers, id='cu-works-selector', multi=True)]),
-                html.Div(dcc.Checklist(['Markers?'], id='cu-works-markers-selector'), style={'padding-top': 25})
+                        dcc.Dropdown(options=search.dropdown_options(work_search, '', None, common.SEARCH_RESULTS), id='cu-works-selector', multi=True)]),
+                html.Div(dcc.Checklist(['Markers?', 'Collapse Movements?'], id='cu-works-markers-selector'), style={'padding-top': 25})
             ], style={'width': '45%', 'float': 'left', 'display': 'inline-block'}),
 
             # Separator
@@ -751,7 +1006,7 @@ def render_tab(tab):
 
             # Kagi chart graph
             html.H2(children='Work Popularity Per Year', style={'textAlign':'center'}),
-            html.Div([dcc.Graph(figure=create_work_pop_by_year_fig(), id='work-kagi-graph')]),
+            html.Div([dcc.Store(data=figure_url(create_work_pop_by_year_fig), id='work-kagi-frames'), dcc.Store(id='work-kagi-request'), dcc.Store(id='work-kagi-pending'), html.Div(id='work-kagi-status', style={'textAlign':'center'}), dcc.Graph(id='work-kagi-graph')]),
             html.Div([ # year_range and top_N tuners
                 html.Div([html.Label("Years Between Each Tick", htmlFor='work-kagi-year-range-selector'),
                         dcc.Dropdown(options=[1,5,10,25], value=5, id='work-kagi-year-range-selector')]),
@@ -760,8 +1015,8 @@ def render_tab(tab):
             ], style={'width': '45%', 'float': 'right', 'display': 'inline-block'}),
             html.Div([ # composer filter and marker selector
                 html.Div([html.Label("Filter by work", htmlFor='kagi-works-selector'),
-                        dcc.Dropdown(options=uniq_works_with_composers, id='kagi-works-selector', multi=True)]),
-                html.Div(dcc.Checklist(['Markers?'], id='work-kagi-markers-selector'), style={'padding-top': 25})
+                        dcc.Dropdown(options=search.dropdown_options(work_search, '', None, common.SEARCH_RESULTS), id='kagi-works-selector', multi=True)]),
+                html.Div(dcc.Checklist(['Markers?', 'Collapse Movements?'], id='work-kagi-markers-selector'), style={'padding-top': 25})
             ], style={'width': '45%', 'float': 'left', 'display': 'inline-block'})
         ])
 
@@ -771,5 +1026,30 @@ def render_tab(tab):
 
 
 
+# Dash finishes setting up the server (callback map, scripts) on its first request, and threaded workers
+# serving several first requests at once could find the callbacks missing, so make that first request now.
+# It is not counted in the request metrics.
+server.test_client().get("/_dash-layout", environ_overrides={"metrics.skip": True})
+
+cold_start["module"] = time.perf_counter() - module_start
+# A preloaded app is forked into the workers, and a fork while the loading thread holds dataset_lock
+# would leave every worker waiting on a lock nobody releases, so a preloaded app always loads at import
+if common.LAZY_INIT and common.PRELOAD_APP:
+    print("LAZY_INIT is ignored when the app is preloaded, loading the dataset at import")
+if common.LAZY_INIT and not common.PRELOAD_APP:
+    threading.Thread(target=load_dataset, daemon=True).start()
+else:
+    load_dataset()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the analysis tool")
+    parser.add_argument("--cold-start-report", action="store_true",
+                        help="load the dataset, print the cold start report and exit with 1 if it is over budget")
+    args = parser.parse_args()
+    if args.cold_start_report:
+        load_dataset()
+        report = cold_start_report()
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["total"] > report["budget"] else 0)
+    request_metrics.reset()
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,74 @@
+// Rebuild the plotly animation frames of a figure sent by the create_*_fig builders.
+// The figure carries the whole trend of every entity once (trends) and each frame lists
+// [trend index, number of points shown] for its traces (see encode_frames in analysis_tool.py).
+function decodeFigure(figure) {
+    const trends = figure.trends;
+    const frames = figure.frames.map(function(frame) {
+        return {
+            name: frame.name,
+            data: frame.traces.map(function(trace) {
+                const index = trace[0], shown = trace[1];
+                return {
+                    type: "scatter",
+                    x: trends.x[index].slice(0, shown),
+                    y: trends.y[index].slice(0, shown),
+                    mode: figure.mode,
+                    name: trends.name[index],
+                    showlegend: true
+                };
+            })
+        };
+    });
+    return {data: figure.data, layout: figure.layout, frames: frames};
+}
+
+// Latest build request of each graph's request store, see debounce
+const latestRequests = {};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    frames: {
+        // Pass a graph's build request on to its pending store (and so to the background job building the figure)
+        // once delay ms have gone by without a newer one. A newer request, or none when the tuning callback found
+        // the figure in the cache, drops it.
+        debounce: function(request, delay) {
+            const no_update = window.dash_clientside.no_update;
+            const graph = window.dash_clientside.callback_context.outputs_list.id;
+            const token = {};
+            latestRequests[graph] = token;
+            if (!request) {
+                return no_update;
+            }
+            return new Promise(function(resolve) {
+                setTimeout(function() {
+                    resolve(latestRequests[graph] === token ? request : no_update);
+                }, delay);
+            });
+        },
+
+        // Fetch a figure from its /figures/ URL (compressed, and a 304 when the browser already has it) and decode it.
+        // Returns [figure, status line]: a failed request keeps the graph and puts the error in the status line.
+        decode: function(url) {
+            const no_update = window.dash_clientside.no_update;
+            if (!url) {
+                return [no_update, no_update];
+            }
+            return fetch(url).then(function(response) {
+                if (response.ok) {
+                    return response.json().then(function(figure) {
+                        return [decodeFigure(figure), ""];
+                    });
+                }
+                // Errors have a JSON {"error": ...} body (see api_error in analysis_tool.py)
+                return response.json().then(function(body) {
+                    return body.error;
+                }, function() {
+                    return response.statusText;
+                }).then(function(error) {
+                    return [no_update, "Could not update the figure: " + error];
+                });
+            }).catch(function(error) {
+                return [no_update, "Could not update the figure: " + error.message];
+            });
+        }
+    }
+});
@@ -1,8 +1,29 @@
+import hashlib
+import os
+import sys
 import pandas as pd
 
+# Shared ingest/aggregate modules live in the Data Collection folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import store
+
 # CONSTANTS
-DF_FILE_LOC_MPL = "../dataframes/"
-DF_FILE_LOC = "./dataframes/"
+# DATAFRAMES_DIR points both at another dataframes folder, e.g. a fixture dataset for benchmarks
+DF_FILE_LOC_MPL = os.environ.get("DATAFRAMES_DIR", "../dataframes/")
+DF_FILE_LOC = os.environ.get("DATAFRAMES_DIR", "./dataframes/")
+FIG_CACHE_DIR = os.path.join(DF_FILE_LOC_MPL, "figure_cache")
+FIG_CACHE_MEMORY_BYTES = 200 * 1024 * 1024 # per worker
+FIG_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024 # shared by all workers
+LAZY_INIT = os.environ.get("LAZY_INIT") == "1" # build the analysis tool's data on first use instead of at import
+PRELOAD_APP = os.environ.get("PRELOAD_APP") == "1" # the app is imported in the gunicorn master and forked, see gunicorn.conf.py
+COLD_START_BUDGET = float(os.environ.get("COLD_START_BUDGET", 5.0)) # seconds from import to ready
+JOB_CACHE_DIR = os.path.join(DF_FILE_LOC_MPL, "job_cache") # queue and results of the background figure callbacks
+JOB_POLL_MS = 100 # how often the browser asks whether a background figure job is done
+FIGURE_DEBOUNCE_MS = 300 # how long the browser waits for tuners to settle before starting a background figure job
+SEARCH_RESULTS = 50 # options a filter dropdown gets for what is typed in it
+MAX_SELECTION = 50 # most names drawn from a filter dropdown, a figure request may not select more
+METRICS_DIR = os.path.join(DF_FILE_LOC_MPL, "metrics") # request metrics of every worker, see metrics.py
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 1.0)) # requests slower than this are logged
 
 pd.options.mode.chained_assignment = None
 
@@ -15,23 +36,61 @@ def normalize_title(title):
     else:
         return title
     
+# Tables written by program_parser.py: the concerts, works and performances dataframes and precomputed aggregates and matrices
+TABLES = ["concerts", "works", "performances", "composer_counts", "work_counts", "rank_index", "work_catalog",
+          "composer_count_matrix", "composer_unique_count_matrix", "work_count_matrix",
+          "work_collapsed_count_matrix", "composer_count_prefix", "composer_unique_count_prefix", "work_count_prefix",
+          "work_collapsed_count_prefix", "composer_performance_count_prefix", "work_performance_count_prefix"]
+
+# Version of the stored tables, changes whenever any of their files is rewritten
+def dataset_version():
+    files = [file for table in TABLES for file in store.table_files(DF_FILE_LOC_MPL, table)]
+    stats = [os.stat(file) for file in files]
+    stamp = [(stat.st_size, stat.st_mtime_ns) for stat in stats]
+    return hashlib.sha256(str(stamp).encode()).hexdigest()[:16]
+
 # MAIN SETUP FUNCTION
-def setup():
-    # Unpickle dataframes
-    concerts = pd.read_pickle(DF_FILE_LOC_MPL + "concerts.pkl")
-    works = pd.read_pickle(DF_FILE_LOC_MPL + "works.pkl")
+# compact=True keeps the frames small: strings are categoricals, years are int16, conductor lists are
+# joined into one categorical string, and the columns the analysis does not use (soloists, the ingest
+# hash, and the concerts dictionaries of each program) are dropped.
+# date is the first performance of the program as a YYYYMMDD integer (0 if it has none) and performances
+# how many times the program was performed, both from the performances table written at ingest.
+def setup(compact=False):
+    # Load dataframes
+    concerts = store.read_table(DF_FILE_LOC_MPL, "concerts", categorical=compact)
+    works = store.read_table(DF_FILE_LOC_MPL, "works", categorical=compact)
 
     # Clean works df
     works = works.query('id != "0*"') # remove all entries that are intermissions
 
-    works['title'] = works['title'].apply(normalize_title)
+    works['title'] = works['title'].astype(object).fillna("Unknown").apply(normalize_title) # missing titles are NaN in a categorical
+
+    ## Add date and performance count columns to concerts and works
+    performances = store.read_table(DF_FILE_LOC_MPL, "performances", ["programID", "date"])
+    first = performances.drop_duplicates("programID").set_index("programID")["date"] # performances are in program order
+    concerts['date'] = concerts['programID'].map(first).fillna(0).astype('int32')
+    concerts['performances'] = concerts['programID'].map(performances['programID'].value_counts()).fillna(0).astype('int32')
+
+    if compact:
+        concerts = concerts.drop(columns=['concerts', 'hash'])
+        concerts['year'] = concerts['year'].astype('int16')
+        works = works.drop(columns=['soloists'])
+        works['title'] = works['title'].astype('category')
+        works['conductor'] = works['conductor'].map('; '.join).astype('category')
+
+    # Merge works with the date and performance count columns
+    works = works.merge(concerts[['programID', 'date', 'performances'] + (['year'] if compact else [])], on='programID', how='left')
+    if compact:
+        works['programID'] = works['programID'].astype('category')
+
+    return concerts, works
 
-    ## Add Date column to concerts and works
-    # extract date from concert-info dictionary as new column
-    concerts['date'] = concerts['concerts'].apply(lambda x : x[0].get('Date', None))
-    # Convert extracted date to ISO8601, UTC datetime format
-    concerts['date'] = pd.to_datetime(concerts['date'], utc=True)
-    # Merge works with the datetime column
-    works = works.merge(concerts[['programID', 'date']], on='programID', how='left')
+# Deep memory use in bytes of each table, e.g. memory_report(concerts=concerts, works=works)
+def memory_report(**tables):
+    return {name: int(table.memory_usage(deep=True).sum()) for name, table in tables.items()}
 
-    return concerts, works
\ No newline at end of file
+if __name__ == "__main__":
+    # Compare the memory of the default and compact frames
+    for compact in [False, True]:
+        report = memory_report(**dict(zip(["concerts", "works"], setup(compact))))
+        print("compact" if compact else "default", {name: "%.1f MB" % (size / 1e6) for name, size in report.items()})
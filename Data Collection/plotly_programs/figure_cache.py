@@ -0,0 +1,228 @@
+import functools
+import gzip
+import hashlib
+import inspect
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content encodings a figure is stored in, best first. Each one is compressed once when the figure is built.
+ENCODINGS = ["br", "gzip", "identity"] if brotli else ["gzip", "identity"]
+
+STALE_TMP_SECONDS = 60 # a temp file this old was never finished
+
+# Serialise a figure dict to JSON bytes, numpy arrays and scalars included
+def dumps(figure):
+    if orjson:
+        return orjson.dumps(figure, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(figure, cls=PlotlyJSONEncoder, separators=(",", ":")).encode()
+
+def encode(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=9)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+# Quality value the client gives each content coding in an Accept-Encoding header, "*" included
+def accepted_encodings(accept_encoding):
+    qualities = {}
+    for part in (accept_encoding or "").split(","):
+        name, *options = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for option in options:
+            if option.lower().startswith("q="):
+                try:
+                    quality = float(option[2:])
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    return qualities
+
+# Best stored encoding the client accepts (Accept-Encoding header): the highest quality value, ties going to
+# the smaller encoding. identity only competes when it is listed (or "*" is), otherwise it is the fallback
+# when no other encoding is accepted.
+def negotiate(accept_encoding):
+    qualities = accepted_encodings(accept_encoding)
+    default = qualities.get("*", 0.0)
+
+    def quality(encoding):
+        return qualities.get(encoding, default)
+
+    return max((encoding for encoding in ENCODINGS if quality(encoding) > 0), key=quality, default="identity")
+
+# Two tier cache for the create_*_fig builders: an LRU dict inside the process, and a folder
+# of files that every gunicorn worker reads and writes. Entries are keyed on a hash of the
+# builder name, its arguments and the dataset version, so new data never hits an old figure.
+# A figure is stored as serialised JSON in every encoding (<key>.<encoding>), so it is
+# serialised and compressed once and then sent as is.
+class FigureCache:
+    def __init__(self, cache_dir, version, max_memory_bytes, max_disk_bytes):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict() # (key, encoding) -> bytes
+        self.memory_bytes = 0
+        self.lookups = {"memory": 0, "disk": 0, "miss": 0} # where get found the figure, for metrics
+        self.lock = threading.Lock()
+        # Background figure jobs are forked from threaded workers, where another thread may hold the lock
+        os.register_at_fork(after_in_child=self._after_fork)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def key(self, name, code, params):
+        blob = json.dumps([self.version, name, code, params], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def path(self, key, encoding):
+        return os.path.join(self.cache_dir, key + "." + encoding)
+
+    def get(self, key, encoding="identity"):
+        with self.lock:
+            if (key, encoding) in self.memory:
+                self.memory.move_to_end((key, encoding))
+                self.lookups["memory"] += 1
+                return self.memory[(key, encoding)]
+
+        path = self.path(key, encoding)
+        try:
+            with open(path, "rb") as file:
+                body = file.read()
+            os.utime(path) # mark as recently used for disk eviction
+        except OSError:
+            with self.lock:
+                self.lookups["miss"] += 1
+            return None
+        with self.lock:
+            self.lookups["disk"] += 1
+        self._remember(key, encoding, body)
+        return body
+
+    # Whether a figure is stored, without reading it. put writes the identity encoding last, so it is there in every encoding.
+    def has(self, key):
+        with self.lock:
+            if (key, "identity") in self.memory:
+                return True
+        return os.path.exists(self.path(key, "identity"))
+
+    def put(self, key, figure):
+        body = dumps(figure)
+        for encoding in ENCODINGS:
+            data = encode(body, encoding)
+            # Write to a temp file first so other workers never read a half written figure
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, self.path(key, encoding))
+        self._evict_disk()
+
+        self._remember(key, "identity", body)
+        return body
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+
+    def _remember(self, key, encoding, body):
+        with self.lock:
+            if (key, encoding) in self.memory:
+                self.memory_bytes -= len(self.memory.pop((key, encoding)))
+            self.memory[(key, encoding)] = body
+            self.memory_bytes += len(body)
+            while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+                self.memory_bytes -= len(self.memory.popitem(last=False)[1])
+
+    def _evict_disk(self):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            try:
+                stat = entry.stat()
+            except OSError: # already evicted by another worker
+                continue
+            if not entry.name.endswith(".tmp"):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif now - stat.st_mtime > STALE_TMP_SECONDS: # left by a cancelled background job
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+# Make builder arguments hashable and JSON friendly (numpy scalars, lists of selections)
+def _normalize(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_normalize(v) for v in value]
+    return value
+
+# Hash of the source code of modules
+def source_hash(modules):
+    digest = hashlib.sha256()
+    for module in modules:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+# Decorator for figure builders. The wrapped builder takes the encoding to send as a keyword
+# and returns the serialised figure in it; wrapper.key gives the cache key of a call without
+# building anything, which doubles as the ETag of the figure.
+# dependencies are the other modules the builder's figures are computed with.
+def cached(cache, dependencies=()):
+    def decorator(builder):
+        signature = inspect.signature(builder)
+        # Figures built by an older version of the builder's module, its dependencies or the serialisation
+        # here are never reused
+        code = source_hash([inspect.getmodule(builder), sys.modules[__name__]] + list(dependencies))
+
+        def key(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {name: _normalize(value) for name, value in bound.arguments.items()}
+            return cache.key(builder.__name__, code, params)
+
+        @functools.wraps(builder)
+        def wrapper(*args, encoding="identity", **kwargs):
+            figure_key = key(*args, **kwargs)
+            body = cache.get(figure_key, encoding)
+            if body is None:
+                body = encode(cache.put(figure_key, builder(*args, **kwargs)), encoding)
+            return body
+
+        wrapper.key = key
+        wrapper.uncached = builder
+        return wrapper
+    return decorator
@@ -0,0 +1,32 @@
+import gc
+import os
+
+# Deployment settings for the analysis tool, picked up by running `gunicorn analysis_tool:server` in this folder.
+# The app is loaded once in the master and the workers are forked from it, so they share its memory:
+# the count matrices are memory-mapped files (one copy in the page cache for every worker) and the
+# python objects built at import stay copy-on-write clean because the garbage collector never writes to them.
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+preload_app = True
+
+# Build the dataset at import in the master, a lazy background load would not survive the fork.
+# Set before any module of the app is imported, common reads these once at import.
+os.environ["LAZY_INIT"] = "0"
+os.environ["PRELOAD_APP"] = "1"
+
+import common
+import metrics
+
+# No collections in the master while the app is loaded, so freed objects do not leave holes in shared pages
+gc.disable()
+
+def on_starting(server):
+    # Request metrics start from zero every run, before any worker writes its numbers
+    metrics.reset(common.METRICS_DIR)
+
+def when_ready(server):
+    # Move everything built so far out of the collector's reach, then fork the workers
+    gc.freeze()
+
+def post_fork(server, worker):
+    gc.enable()
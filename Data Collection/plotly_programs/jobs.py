@@ -0,0 +1,76 @@
+import os
+import threading
+import uuid
+
+from dash import DiskcacheManager
+
+# Background callback manager for threaded workers. Dash's DiskcacheManager forks a process for every job,
+# and a fork copies only the forking thread: if another thread of the worker was inside the job cache
+# (SQLite) at that moment, the locks it held are never released in the child, which then hangs on its
+# first cache write. Here every use of the job cache in a process goes through one lock, and the fork
+# happens while holding it, so no other thread can be inside SQLite then.
+class JobManager(DiskcacheManager):
+    def __init__(self, cache, **kwargs):
+        super().__init__(cache, **kwargs)
+        self.lock = threading.RLock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.lock = threading.RLock()
+
+    # Dash keys the result of a job on the callback and its arguments, so two users asking for the same figure at
+    # once would share a result, and the first to read it deletes it from under the other. Key every job apart,
+    # the figures themselves are cached by figure_cache.
+    def build_cache_key(self, fn, args, cache_args_to_ignore, triggered):
+        return super().build_cache_key(fn, args, cache_args_to_ignore, triggered) + "-" + uuid.uuid4().hex
+
+    def call_job_fn(self, key, job_fn, args, context):
+        with self.lock:
+            return super().call_job_fn(key, job_fn, args, context)
+
+    # Kill a job and its children. Dash does this inside a job cache transaction and then waits a second for the
+    # job to go, which never happens when it is a finished job (a zombie) of another worker: every worker's cache
+    # writes were blocked for that second. A job can also be reaped by its worker meanwhile, which is fine.
+    def terminate_job(self, job):
+        import psutil
+
+        if job is None:
+            return
+        try:
+            process = psutil.Process(int(job))
+            if process.status() == psutil.STATUS_ZOMBIE:
+                return
+            for child in process.children(recursive=True):
+                try:
+                    child.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            process.kill()
+            if process.ppid() == os.getpid():
+                process.wait(1) # reap it
+        except (psutil.NoSuchProcess, psutil.TimeoutExpired):
+            pass
+
+    def clear_cache_entry(self, key):
+        with self.lock:
+            return super().clear_cache_entry(key)
+
+    def get_or_create_signing_secret(self, generate):
+        with self.lock:
+            return super().get_or_create_signing_secret(generate)
+
+    def get_progress(self, key):
+        with self.lock:
+            return super().get_progress(key)
+
+    def result_ready(self, key):
+        with self.lock:
+            return super().result_ready(key)
+
+    def get_result(self, key, job):
+        with self.lock:
+            return super().get_result(key, job)
+
+    def get_updated_props(self, key):
+        with self.lock:
+            return super().get_updated_props(key)
@@ -0,0 +1,225 @@
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import Response, request
+
+# Request metrics for the analysis tool: call counts, latency and response size histograms of every
+# Dash callback and figure fetch, figure cache lookups and worker memory, served on /metrics in the
+# Prometheus text format, and a log line for every slow request. Recording a request is a few dict
+# updates under a lock. Each gunicorn worker keeps its own numbers and writes them to a file in
+# common.METRICS_DIR every few seconds, so whichever worker answers /metrics reports all of them.
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30] # seconds
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216] # bytes
+FLUSH_SECONDS = 5 # how often a worker writes its numbers for the other workers
+
+logger = logging.getLogger("analysis_tool.metrics")
+
+# Resident memory of a process in bytes, None where /proc is not available
+def rss(pid="self"):
+    try:
+        with open("/proc/%s/statm" % pid) as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Counts per bucket (not cumulative, the last one is +Inf), sum and count of the observations
+def new_histogram(buckets):
+    return [[0] * (len(buckets) + 1), 0.0, 0]
+
+def observe(histogram, buckets, value):
+    histogram[0][bisect.bisect_left(buckets, value)] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+# Label tuples are stored as JSON lists in the worker files
+def merge_counts(total, items):
+    for labels, count in items:
+        total[tuple(labels)] = total.get(tuple(labels), 0) + count
+
+def merge_histograms(total, items):
+    for labels, (counts, value_sum, count) in items:
+        histogram = total.setdefault(tuple(labels), [[0] * len(counts), 0.0, 0])
+        histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+        histogram[1] += value_sum
+        histogram[2] += count
+
+class Metrics:
+    def __init__(self, metrics_dir, slow_seconds, cache=None):
+        self.metrics_dir = metrics_dir
+        self.slow_seconds = slow_seconds
+        self.cache = cache # figure_cache.FigureCache whose lookups are reported
+        self.requests = {} # (kind, name, output, status) -> count
+        self.durations = {} # (kind, name, output) -> histogram
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.dirty = False # recorded requests not written yet
+        self.flusher_pid = None # process the flush thread runs in, threads do not survive the fork of a worker
+
+    def record(self, labels, status, seconds, size):
+        with self.lock:
+            key = labels + (str(status),)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            observe(self.durations.setdefault(labels, new_histogram(LATENCY_BUCKETS)), LATENCY_BUCKETS, seconds)
+            if size is not None:
+                observe(self.sizes.setdefault(labels, new_histogram(SIZE_BUCKETS)), SIZE_BUCKETS, size)
+            self.dirty = True
+            start_flusher = self.flusher_pid != os.getpid()
+            self.flusher_pid = os.getpid()
+        if start_flusher:
+            threading.Thread(target=self.flush_loop, daemon=True).start()
+
+    # Write this worker's numbers every FLUSH_SECONDS while it records requests, also once it goes idle
+    def flush_loop(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            if self.dirty:
+                self.flush()
+
+    # This worker's numbers, in the form they are written to its file
+    def snapshot(self):
+        with self.lock:
+            return {"pid": os.getpid(), "rss": rss(),
+                    "requests": [[list(labels), count] for labels, count in self.requests.items()],
+                    "durations": [[list(labels), histogram] for labels, histogram in self.durations.items()],
+                    "sizes": [[list(labels), histogram] for labels, histogram in self.sizes.items()],
+                    "cache": dict(self.cache.lookups) if self.cache else {}}
+
+    def path(self, pid):
+        return os.path.join(self.metrics_dir, "%d.json" % pid)
+
+    def flush(self):
+        self.dirty = False
+        snapshot = self.snapshot()
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.metrics_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as file:
+                json.dump(snapshot, file)
+            os.replace(tmp_path, self.path(snapshot["pid"]))
+        except OSError:
+            logger.exception("could not write metrics to %s", self.metrics_dir)
+
+    def reset(self):
+        reset(self.metrics_dir)
+
+    # Snapshots of every worker of this run, this one's live. Counters of workers that exited still count.
+    def snapshots(self):
+        own = self.snapshot()
+        snapshots = [own]
+        for entry in os.scandir(self.metrics_dir):
+            if entry.name.endswith(".json") and entry.name != "%d.json" % own["pid"]:
+                try:
+                    with open(entry.path) as file:
+                        snapshots.append(json.load(file))
+                except (OSError, ValueError): # being replaced
+                    continue
+        return snapshots
+
+    def render(self):
+        requests, durations, sizes, cache = {}, {}, {}, {}
+        memory = []
+        for snapshot in self.snapshots():
+            merge_counts(requests, snapshot["requests"])
+            merge_histograms(durations, snapshot["durations"])
+            merge_histograms(sizes, snapshot["sizes"])
+            merge_counts(cache, [[[result], count] for result, count in snapshot["cache"].items()])
+            if snapshot["rss"] is not None and alive(snapshot["pid"]):
+                memory.append(((str(snapshot["pid"]),), snapshot["rss"]))
+
+        lines = []
+        lines += family("dash_requests_total", "counter", "Requests by callback or figure and status",
+                        ["kind", "name", "output", "status"], sorted(requests.items()))
+        lines += histogram_family("dash_request_duration_seconds", "Time to answer a request", LATENCY_BUCKETS, durations)
+        lines += histogram_family("dash_response_bytes", "Size of the response body as sent", SIZE_BUCKETS, sizes)
+        lines += family("figure_cache_lookups_total", "counter", "Figure cache lookups by where the figure was found",
+                        ["result"], sorted(cache.items()))
+        lines += family("process_resident_memory_bytes", "gauge", "Resident memory of each live worker", ["pid"], sorted(memory))
+        return "\n".join(lines) + "\n"
+
+    # Time every request of a Flask app, label it in before_request and serve /metrics
+    def install(self, server, label):
+        wsgi_app = server.wsgi_app
+
+        def timed_app(environ, start_response):
+            if environ.get("metrics.skip"):
+                return wsgi_app(environ, start_response)
+            start = time.perf_counter()
+            response = {}
+
+            def record_start(status, headers, exc_info=None):
+                response["status"] = int(status.split()[0])
+                response["size"] = next((int(value) for name, value in headers if name.lower() == "content-length"), None)
+                return start_response(status, headers, exc_info)
+
+            try:
+                return wsgi_app(environ, record_start)
+            finally:
+                seconds = time.perf_counter() - start
+                labels = environ.get("metrics.labels", ("other", "", ""))
+                status = response.get("status", 500)
+                self.record(labels, status, seconds, response.get("size"))
+                if seconds > self.slow_seconds:
+                    logger.warning(json.dumps({"event": "slow_request", "kind": labels[0], "name": labels[1], "output": labels[2],
+                                               "path": environ.get("PATH_INFO"), "status": status, "seconds": round(seconds, 3),
+                                               "bytes": response.get("size"), "pid": os.getpid(), "rss": rss(),
+                                               "inputs": environ.get("metrics.inputs")}, default=str))
+
+        server.wsgi_app = timed_app
+
+        @server.before_request
+        def label_request():
+            request.environ["metrics.labels"], request.environ["metrics.inputs"] = label(request)
+
+        @server.route("/metrics")
+        def send_metrics():
+            return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+# Forget the numbers of a previous run. Called once per run before any worker starts (the gunicorn master's
+# on_starting hook), never by a worker, which would delete what the workers started before it have written.
+def reset(metrics_dir):
+    os.makedirs(metrics_dir, exist_ok=True)
+    for entry in os.scandir(metrics_dir):
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+# Lines of one metric family in the Prometheus text format
+def family(name, kind, help, label_names, items):
+    lines = ["# HELP %s %s" % (name, help), "# TYPE %s %s" % (name, kind)]
+    for labels, value in items:
+        lines.append("%s{%s} %s" % (name, format_labels(label_names, labels), format_value(value)))
+    return lines
+
+def histogram_family(name, help, buckets, histograms):
+    lines = ["# HELP %s %s" % (name, help), "# TYPE %s histogram" % name]
+    for labels, (counts, value_sum, count) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ["+Inf"], counts):
+            cumulative += bucket_count
+            lines.append("%s_bucket{%s} %d" % (name, format_labels(["kind", "name", "output", "le"], labels + (str(bound),)), cumulative))
+        lines.append("%s_sum{%s} %s" % (name, format_labels(["kind", "name", "output"], labels), format_value(value_sum)))
+        lines.append("%s_count{%s} %d" % (name, format_labels(["kind", "name", "output"], labels), count))
+    return lines
+
+def format_labels(names, values):
+    return ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for name, value in zip(names, values))
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
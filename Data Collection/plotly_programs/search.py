@@ -0,0 +1,65 @@
+import re
+import unicodedata
+
+import numpy as np
+
+# Server-side search for the composer and work filter dropdowns, so the browser gets a few dozen matches
+# instead of every name. Names and queries are folded (accents removed, case folded) and split into
+# words, and a name matches when every word of the query starts one of its words, in any order:
+# "dvor sym" finds "Dvořák, Antonín: SYMPHONY NO. 9". Matches come out most programmed first.
+
+# Letters that have no decomposed form to strip an accent from
+LETTERS = str.maketrans({"ø": "o", "Ø": "O", "ł": "l", "Ł": "L", "đ": "d", "Đ": "D", "æ": "ae", "Æ": "AE", "œ": "oe", "Œ": "OE"})
+
+def fold(text):
+    decomposed = unicodedata.normalize("NFKD", text.translate(LETTERS))
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def tokens(text):
+    return re.findall(r"\w+", fold(text))
+
+# Sorted array of every word of every name with the name it comes from. Names are numbered by
+# popularity, so the matches of a query sorted by number are already ranked.
+class SearchIndex:
+    def __init__(self, names, popularity):
+        order = np.argsort(-np.asarray(popularity), kind="stable")
+        self.names = np.asarray(names, dtype=object)[order]
+        words, ranks = [], []
+        for rank, name in enumerate(self.names):
+            for word in set(tokens(name)):
+                words.append(word)
+                ranks.append(rank)
+        words = np.array(words, dtype=object) # a fixed width array would pad every word to the longest
+        by_word = np.argsort(words, kind="stable")
+        self.words = words[by_word]
+        self.ranks = np.array(ranks, dtype=np.int32)[by_word]
+
+    # Ranks of the names with a word starting with prefix
+    def prefix_ranks(self, prefix):
+        lo = np.searchsorted(self.words, prefix, side="left")
+        hi = np.searchsorted(self.words, prefix + "\U0010ffff", side="left")
+        return np.unique(self.ranks[lo:hi])
+
+    # Names matching every word of query, most popular first; an empty query gives the most popular names
+    def search(self, query, limit):
+        words = tokens(query or "")
+        if not words:
+            return self.names[:limit].tolist()
+        matches = None
+        for word in sorted(set(words), key=len, reverse=True): # longest words match fewest names
+            ranks = self.prefix_ranks(word)
+            matches = ranks if matches is None else np.intersect1d(matches, ranks, assume_unique=True)
+            if len(matches) == 0:
+                break
+        return self.names[matches[:limit]].tolist()
+
+# Option of a dropdown for a name. The dropdown filters its options again in the browser by label, value and
+# search, without folding accents, so search holds the folded name for what the server matched to show up.
+def option(name):
+    return {"label": name, "value": name, "search": fold(name)}
+
+# Options of a filter dropdown for what is typed in it: the best matches, plus what is already selected,
+# which the dropdown can only show while it is among the options
+def dropdown_options(index, search_value, selected, limit):
+    selected = list(selected or [])
+    return [option(name) for name in selected + [name for name in index.search(search_value, limit) if name not in selected]]
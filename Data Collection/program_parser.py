@@ -1,10 +1,29 @@
+import argparse
+import collections
+import hashlib
+import itertools
 import json
-import pandas as pd
-from Classes import Concert, Work
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from common import *
+import aggregates
+import store
 
-concerts = []
-works = []
+BATCH_SIZE = 5000 # programs per batch when streaming
+READ_SIZE = 1 << 20 # characters read from complete.json at a time when streaming
+CHUNK_SIZE = 500 # programs normalised per task when parsing in parallel
+
+# Columns of the concerts, works and performances tables (None = dictionary encoded, store.JSON = JSON text per row).
+# Only columns with few distinct values are dictionary encoded, the distinct values are kept in memory until the
+# table is closed. The works of a program are only kept in the works table.
+# Tables are partitioned by the decade of each program's first performance.
+CONCERT_COLUMNS = {"id": store.JSON, "programID": store.JSON, "orchestra": None, "season": None, "concerts": store.JSON,
+                   "year": np.int32, "hash": store.JSON}
+WORK_COLUMNS = {"id": None, "programID": store.JSON, "composer": None, "title": None, "movement": None, "conductor": None,
+                "soloists": store.JSON}
+# One row per performance (entry of a program's concerts list), dates as YYYYMMDD integers, 0 when missing
+PERFORMANCE_COLUMNS = {"programID": store.JSON, "date": np.int32, "year": np.int32, "venue": None, "eventType": None}
 
 def clean_doublespace(string):
     if not isinstance(string, str):
@@ -14,33 +33,256 @@ def clean_doublespace(string):
 def clean_conductor(conductors):
     return conductors.split("; ")
 
+# Year of the first performance of a program, 0 if it has no date
+def program_year(concert):
+    date = concert["concerts"][0].get("Date") if concert["concerts"] else None
+    return int(date[:4]) if date else 0
+
+# Date of a performance as a YYYYMMDD integer, 0 if it has none. Dates are midnight New York time written
+# in UTC ("1842-12-07T05:00:00Z"), so the day is the one written.
+def performance_date(performance):
+    date = performance.get("Date")
+    return int(date[:4] + date[5:7] + date[8:10]) if date else 0
+
+def partition_key(year):
+    return str(year // 10 * 10)
+
+# Content hash of a program, used to find changed programs when re-ingesting
+def program_hash(concert):
+    return hashlib.sha1(json.dumps(concert, sort_keys=True).encode()).hexdigest()
+
+# Append one program, its works and its performances straight onto the columns of the concerts, works and
+# performances tables
+def parse_program(concert, concerts, works, performances):
+    concerts["id"].append(concert["id"])
+    concerts["programID"].append(concert["programID"])
+    concerts["orchestra"].append(concert["orchestra"])
+    concerts["season"].append(concert["season"])
+    concerts["concerts"].append(concert["concerts"])
+    concerts["year"].append(program_year(concert))
+    concerts["hash"].append(program_hash(concert))
+
+    for work in concert["works"]:
+        works["id"].append(work.get("ID", "unknown_id"))
+        works["programID"].append(concert["programID"])
+        works["composer"].append(clean_doublespace(work.get("composerName", "Unknown,")))
+        works["title"].append(clean_doublespace(work.get("workTitle", "Unknown")))
+        works["movement"].append(clean_doublespace(work.get("movement", "")))
+        works["conductor"].append(clean_conductor(clean_doublespace(work.get("conductorName", "Unknown"))))
+        works["soloists"].append(work.get("soloists", []))
 
+    for performance in concert["concerts"]:
+        date = performance_date(performance)
+        performances["programID"].append(concert["programID"])
+        performances["date"].append(date)
+        performances["year"].append(date // 10000)
+        performances["venue"].append(performance.get("Venue"))
+        performances["eventType"].append(performance.get("eventType"))
 
-# Create lists of concerts and works
-with open("complete.json") as file:
-    programs = json.load(file)["programs"]
+# Yield programs one at a time from the "programs" array without loading the whole document
+def iter_programs(path, read_size=READ_SIZE):
+    decoder = json.JSONDecoder()
+    with open(path) as file:
+        buffer = ""
+        # Skip ahead to the opening bracket of the programs array
+        while True:
+            key = buffer.find('"programs"')
+            start = buffer.find("[", key) if key != -1 else -1
+            if start != -1:
+                break
+            chunk = file.read(read_size)
+            if not chunk:
+                raise ValueError(path + " has no programs array")
+            buffer += chunk
+        pos = start + 1
 
-    #normalized_programs_df = pd.json_normalize(programs)
-    #print(list(normalized_programs_df))
+        while True:
+            # Skip separators between programs
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                program, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Program is cut off by the end of the buffer, read more
+                chunk = file.read(read_size)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield program
+            pos = end
+            # Drop what has been decoded so the buffer stays small
+            if pos > read_size:
+                buffer = buffer[pos:]
+                pos = 0
 
+# Normalise a chunk of programs into plain column lists per partition, skipping partitions not in only.
+# Runs in a worker process when parsing in parallel.
+def normalize_chunk(programs, only=None):
+    parts = {}
     for concert in programs:
-        c = Concert(concert["id"], concert["programID"], concert["orchestra"], concert["season"], concert["concerts"], concert["works"])
-        concerts.append(c)
-
-        for work in concert["works"]:         
-            w = Work(work.get("ID", "unknown_id"), 
-                     concert["programID"],
-                     clean_doublespace(work.get("composerName", "Unknown,")), 
-                     clean_doublespace(work.get("workTitle", "Unknown")),
-                     clean_doublespace(work.get("movement", "")),
-                     clean_conductor(clean_doublespace(work.get("conductorName", "Unknown"))), 
-                     work.get("soloists", []))
-            works.append(w)
-
-# Convert to Pandas Dataframe
-concerts_df = pd.DataFrame([vars(c) for c in concerts])
-works_df = pd.DataFrame([vars(w) for w in works])
-
-concerts_df.to_pickle(DF_FILE_LOC + "concerts.pkl")
-works_df.to_pickle(DF_FILE_LOC + "works.pkl")
-print("Concerts + works parsed and saved to pickles.")
\ No newline at end of file
+        key = partition_key(program_year(concert))
+        if only is not None and key not in only:
+            continue
+        if key not in parts:
+            parts[key] = ({column: [] for column in CONCERT_COLUMNS}, {column: [] for column in WORK_COLUMNS},
+                          {column: [] for column in PERFORMANCE_COLUMNS})
+        parse_program(concert, *parts[key])
+    return parts
+
+# Normalised chunks in the same order as the programs, from a pool of worker processes when workers > 1.
+# Only a few chunks are in flight at a time so streaming memory stays bounded.
+def normalized_chunks(programs, only=None, workers=1):
+    programs = iter(programs)
+    chunks = iter(lambda: list(itertools.islice(programs, CHUNK_SIZE)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield normalize_chunk(chunk, only)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(normalize_chunk, chunk, only))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Write programs into the partitioned concerts, works and performances tables, flushing every batch_size programs.
+# With only set, just those partitions are rewritten and the rest are left untouched.
+# Chunks are merged in program order, so the output is identical for any number of workers.
+def write_programs(programs, batch_size=None, only=None, workers=1):
+    replace = only is None
+    concerts = store.PartitionedWriter(DF_FILE_LOC, "concerts", CONCERT_COLUMNS, replace)
+    works = store.PartitionedWriter(DF_FILE_LOC, "works", WORK_COLUMNS, replace)
+    performances = store.PartitionedWriter(DF_FILE_LOC, "performances", PERFORMANCE_COLUMNS, replace)
+    tables = [concerts, works, performances]
+    for parts in normalized_chunks(programs, only, workers):
+        for key, columns in parts.items():
+            for table, table_columns in zip(tables, columns):
+                for column, values in table_columns.items():
+                    table.partition(key).columns[column].extend(values)
+        if batch_size and concerts.buffered() >= batch_size:
+            for table in tables:
+                table.flush()
+
+    written = set(concerts.writers)
+    removed = set(only or []) - written
+    for key in removed:
+        for table in tables:
+            table.remove(key)
+    for table in tables:
+        table.close()
+    write_counts(written, removed, replace)
+    write_aggregates()
+
+# Precompute composer and work counts per year for the given partitions of the works table, the performance
+# counts binned by the year of each performance
+def write_counts(keys, removed, replace):
+    composer_counts = store.PartitionedWriter(DF_FILE_LOC, "composer_counts", None, replace)
+    work_counts = store.PartitionedWriter(DF_FILE_LOC, "work_counts", None, replace)
+    for key in sorted(keys):
+        concerts = store.read_table(os.path.join(DF_FILE_LOC, "concerts"), key, ["programID", "year"])
+        works = store.read_table(os.path.join(DF_FILE_LOC, "works"), key, ["id", "programID", "composer", "title"])
+        performances = store.read_table(os.path.join(DF_FILE_LOC, "performances"), key, ["programID", "year"])
+        works["title"] = works["title"].apply(normalize_title)
+        program_years = dict(zip(concerts["programID"], concerts["year"]))
+        composer_counts.write(key, aggregates.year_counts(works, program_years, performances, ["composer"]))
+        work_counts.write(key, aggregates.work_year_counts(works, program_years, performances))
+    for key in removed:
+        composer_counts.remove(key)
+        work_counts.remove(key)
+    composer_counts.close()
+    work_counts.close()
+
+# Precompute from the yearly counts of all partitions what the analysis tool serves from: the
+# (entity x year) count matrices, memory-mapped by every worker, the work catalog, and the top
+# entities of every animation frame
+def write_aggregates():
+    composers = store.read_table(DF_FILE_LOC, "composer_counts")
+    works = store.read_table(DF_FILE_LOC, "work_counts")
+    composer_names, (composer_total, composer_unique, composer_performances) = aggregates.entity_matrices(
+        composers, "composer", ["count", "unique_count", "performance_count"])
+    work_names, (work_total, work_collapsed, work_performances) = aggregates.entity_matrices(
+        works, "work", ["count", "collapsed_count", "performance_count"])
+    store.write_matrix(DF_FILE_LOC, "composer_count_matrix", composer_names, composer_total)
+    store.write_matrix(DF_FILE_LOC, "composer_unique_count_matrix", composer_names, composer_unique)
+    store.write_matrix(DF_FILE_LOC, "work_count_matrix", work_names, work_total)
+    store.write_matrix(DF_FILE_LOC, "work_collapsed_count_matrix", work_names, work_collapsed)
+    # Prefix sums of the matrices for the range count API
+    store.write_matrix(DF_FILE_LOC, "composer_count_prefix", composer_names, aggregates.prefix_sums(composer_total))
+    store.write_matrix(DF_FILE_LOC, "composer_unique_count_prefix", composer_names, aggregates.prefix_sums(composer_unique))
+    store.write_matrix(DF_FILE_LOC, "work_count_prefix", work_names, aggregates.prefix_sums(work_total))
+    store.write_matrix(DF_FILE_LOC, "work_collapsed_count_prefix", work_names, aggregates.prefix_sums(work_collapsed))
+    store.write_matrix(DF_FILE_LOC, "composer_performance_count_prefix", composer_names, aggregates.prefix_sums(composer_performances))
+    store.write_matrix(DF_FILE_LOC, "work_performance_count_prefix", work_names, aggregates.prefix_sums(work_performances))
+    store.write_table(DF_FILE_LOC, "work_catalog", aggregates.work_catalog(works))
+    store.write_table(DF_FILE_LOC, "rank_index", aggregates.rank_index_table({
+        ("composer", "count"): (composer_names, composer_total),
+        ("composer", "unique_count"): (composer_names, composer_unique),
+        ("work", "count"): (work_names, work_total),
+        ("work", "collapsed_count"): (work_names, work_collapsed),
+    }))
+
+# Parse the whole file at once and save each table in one go
+def parse(path, workers=1):
+    with open(path) as file:
+        programs = json.load(file)["programs"]
+    write_programs(programs, workers=workers)
+
+# Stream programs from the file and flush the tables every batch_size programs,
+# so memory use does not grow with the size of the archive
+def parse_streaming(path, batch_size=BATCH_SIZE, workers=1):
+    write_programs(iter_programs(path), batch_size, workers=workers)
+
+# Compare a new export with the stored tables by programID and content hash, then rewrite only
+# the partitions with added, changed or removed programs. Returns the rewritten partitions.
+def parse_incremental(path, batch_size=BATCH_SIZE, workers=1):
+    partitions = store.read_partitions(DF_FILE_LOC, "concerts")
+    if partitions is None:
+        parse_streaming(path, batch_size, workers)
+        return None
+
+    stored = {} # programID -> (partition, hash)
+    for key in partitions:
+        table = store.read_table(os.path.join(DF_FILE_LOC, "concerts"), key, ["programID", "hash"])
+        stored.update((program_id, (key, digest)) for program_id, digest in zip(table["programID"], table["hash"]))
+
+    affected = set()
+    seen = set()
+    for concert in iter_programs(path):
+        key = partition_key(program_year(concert))
+        seen.add(concert["programID"])
+        old = stored.get(concert["programID"])
+        if old != (key, program_hash(concert)):
+            affected.add(key)
+            if old is not None: # changed or moved to another partition
+                affected.add(old[0])
+    affected.update(key for program_id, (key, _) in stored.items() if program_id not in seen)
+
+    if affected:
+        write_programs(iter_programs(path), batch_size, only=affected, workers=workers)
+    return affected
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse complete.json into the concerts and works tables")
+    parser.add_argument("path", nargs="?", default="complete.json")
+    parser.add_argument("--stream", action="store_true", help="stream the programs array and write tables in batches")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="programs per batch when streaming")
+    parser.add_argument("--incremental", action="store_true", help="only rewrite partitions whose programs changed since the last run")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to normalise programs")
+    args = parser.parse_args()
+
+    if args.incremental:
+        affected = parse_incremental(args.path, args.batch_size, args.workers)
+        if affected is not None:
+            print("Rewrote partitions: " + (", ".join(sorted(affected)) or "none"))
+    elif args.stream:
+        parse_streaming(args.path, args.batch_size, args.workers)
+    else:
+        parse(args.path, args.workers)
+    print("Concerts + works parsed and saved to " + DF_FILE_LOC)
@@ -0,0 +1,316 @@
+import array
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Tables are stored in the dataframes folder as a folder of columns (<name>/):
+# - meta.json lists the columns, their kind and the number of rows
+# - numeric columns are raw fixed width arrays (<column>.bin) that are memory-mapped on read
+# - columns of few distinct values are dictionary encoded: int32 codes (<column>.bin) plus the list of
+#   distinct values (<column>.dict.json), so repeated composers, titles and conductor lists are stored once
+# - columns of values that are mostly different on every row (program IDs, hashes, the nested concerts
+#   and soloists lists) are stored as the JSON text of each row followed by a comma (<column>.bin), so
+#   writing them keeps nothing in memory between flushes and reading them is one JSON parse
+# A matrix (<name>/) is stored the same way: meta.json with its shape and dtype, the raw array
+# (matrix.bin) that is memory-mapped on read, and its row labels (labels.json).
+# A partitioned table is a folder of such tables (<name>/<partition>/) plus partitions.json listing
+# them in order, so one partition can be rewritten without touching the others.
+# Old pickled tables (<name>.pkl) can still be read.
+
+CODE_DTYPE = np.int32
+JSON = "json" # column spec of a JSON column, see TableWriter
+
+# Buffer for a dictionary encoded column. Each distinct value is kept once (so strings are interned)
+# and rows only hold an int32 code.
+class DictionaryColumn:
+    kind = "dictionary"
+    dtype = np.dtype(CODE_DTYPE)
+
+    def __init__(self):
+        self.codes = array.array("i")
+        self.lookup = {} # string, or JSON text of any other value -> code
+        self.values = [] # distinct values, in code order
+
+    def append(self, value):
+        key = value if isinstance(value, str) else (json.dumps(value, sort_keys=True),)
+        code = self.lookup.get(key)
+        if code is None:
+            code = self.lookup[key] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.codes)
+
+    # Hand over the buffered rows as an array and start a new buffer
+    def take(self):
+        data = np.frombuffer(self.codes, dtype=CODE_DTYPE).copy()
+        self.codes = array.array("i")
+        return data
+
+# Buffer for a JSON column, rows are encoded when they are handed over
+class JsonColumn:
+    kind = "json"
+    dtype = np.dtype(np.uint8)
+
+    def __init__(self):
+        self.rows = []
+
+    def append(self, value):
+        self.rows.append(value)
+
+    def extend(self, values):
+        self.rows.extend(values)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def take(self):
+        text = json.dumps(self.rows, separators=(",", ":"))[1:-1] + "," if self.rows else ""
+        self.rows = []
+        return np.frombuffer(text.encode(), dtype=self.dtype)
+
+# Buffer for a fixed width numeric column
+class NumericColumn:
+    kind = "numeric"
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.data = array.array(self.dtype.char)
+
+    def append(self, value):
+        self.data.append(value)
+
+    def extend(self, values):
+        self.data.extend(values)
+
+    def __len__(self):
+        return len(self.data)
+
+    def take(self):
+        data = np.frombuffer(self.data, dtype=self.dtype).copy()
+        self.data = array.array(self.dtype.char)
+        return data
+
+# Write a table by appending rows to its column buffers (writer.columns) and flushing them to
+# disk every so often, replacing any previous copy of the table.
+# columns maps column name -> numeric dtype, None for a dictionary encoded column or JSON for a JSON column.
+class TableWriter:
+    def __init__(self, loc, name, columns):
+        self.path = os.path.join(loc, name)
+        shutil.rmtree(self.path, ignore_errors=True)
+        if os.path.exists(self.path + ".pkl"):
+            os.remove(self.path + ".pkl")
+        os.makedirs(self.path)
+        self.columns = {column: new_column(dtype) for column, dtype in columns.items()}
+        self.length = 0
+
+    # Number of rows waiting in the buffers
+    def buffered(self):
+        return max((len(buffer) for buffer in self.columns.values()), default=0)
+
+    def flush(self):
+        length = self.buffered()
+        for column, buffer in self.columns.items():
+            if len(buffer) != length:
+                raise ValueError("column " + column + " has a different number of rows")
+            with open(os.path.join(self.path, column + ".bin"), "ab") as file:
+                buffer.take().tofile(file)
+        self.length += length
+
+    def close(self):
+        self.flush()
+        for column, buffer in self.columns.items():
+            if buffer.kind == "dictionary":
+                with open(os.path.join(self.path, column + ".dict.json"), "w") as file:
+                    json.dump(buffer.values, file)
+        # meta.json is written last, so a table without it was never finished
+        meta = {"length": self.length,
+                "columns": {column: {"kind": buffer.kind, "dtype": buffer.dtype.str}
+                            for column, buffer in self.columns.items()}}
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+def new_column(dtype):
+    if dtype is None:
+        return DictionaryColumn()
+    if dtype is JSON:
+        return JsonColumn()
+    return NumericColumn(dtype)
+
+# Write a whole dataframe as a table
+def write_table(loc, name, df):
+    writer = TableWriter(loc, name, {column: dtype if dtype.kind in "iuf" else None
+                                     for column, dtype in df.dtypes.items()})
+    for column, buffer in writer.columns.items():
+        buffer.extend(df[column].tolist())
+    writer.close()
+
+# Write a partitioned table, one TableWriter per partition.
+# With replace=False the partitions that are not written to are kept as they are.
+# columns is only needed when rows are appended through partition(key).
+class PartitionedWriter:
+    def __init__(self, loc, name, columns, replace=True):
+        self.path = os.path.join(loc, name)
+        self.columns = columns
+        if replace:
+            shutil.rmtree(self.path, ignore_errors=True)
+        if os.path.exists(self.path + ".pkl"):
+            os.remove(self.path + ".pkl")
+        os.makedirs(self.path, exist_ok=True)
+        self.writers = {}
+
+    def partition(self, key):
+        if key not in self.writers:
+            self.writers[key] = TableWriter(self.path, key, self.columns)
+        return self.writers[key]
+
+    # Write a whole dataframe as one partition
+    def write(self, key, df):
+        write_table(self.path, key, df)
+
+    # Delete a partition that no longer has any rows
+    def remove(self, key):
+        self.writers.pop(key, None)
+        shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+
+    def buffered(self):
+        return sum(writer.buffered() for writer in self.writers.values())
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        with open(os.path.join(self.path, "partitions.json"), "w") as file:
+            json.dump(sorted(key for key in os.listdir(self.path)
+                             if os.path.exists(os.path.join(self.path, key, "meta.json"))), file)
+
+# Write a 2d array with a label per row, replacing any previous copy
+def write_matrix(loc, name, labels, matrix):
+    path = os.path.join(loc, name)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    matrix = np.ascontiguousarray(matrix)
+    matrix.tofile(os.path.join(path, "matrix.bin"))
+    with open(os.path.join(path, "labels.json"), "w") as file:
+        json.dump(list(labels), file)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump({"shape": matrix.shape, "dtype": matrix.dtype.str}, file)
+
+# Row labels and read-only memory map of a matrix. The pages come from the OS page cache,
+# so every process that maps the same matrix shares one copy of it.
+def read_matrix(loc, name):
+    meta = read_meta(loc, name)
+    with open(os.path.join(loc, name, "labels.json")) as file:
+        labels = json.load(file)
+    labels = np.fromiter(labels, dtype=object, count=len(labels))
+    shape = tuple(meta["shape"])
+    if 0 in shape:
+        return labels, np.empty(shape, dtype=np.dtype(meta["dtype"]))
+    return labels, np.memmap(os.path.join(loc, name, "matrix.bin"), dtype=np.dtype(meta["dtype"]), mode="r", shape=shape)
+
+# Partitions of a partitioned table in order, or None for a plain table
+def read_partitions(loc, name):
+    path = os.path.join(loc, name, "partitions.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+# Files that make up a table
+def table_files(loc, name):
+    path = os.path.join(loc, name)
+    if not os.path.isdir(path):
+        return [path + ".pkl"]
+    files = []
+    for folder, _, names in os.walk(path):
+        files.extend(os.path.join(folder, file) for file in names)
+    return sorted(files)
+
+def read_meta(loc, name):
+    with open(os.path.join(loc, name, "meta.json")) as file:
+        return json.load(file)
+
+# Memory-map the raw array behind a column: the values of a numeric column, the codes of a dictionary column
+def read_array(loc, name, column, meta=None):
+    meta = meta or read_meta(loc, name)
+    dtype = np.dtype(meta["columns"][column]["dtype"])
+    if meta["length"] == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(os.path.join(loc, name, column + ".bin"), dtype=dtype, mode="r", shape=(meta["length"],))
+
+# Values of a JSON column, in row order
+def read_json(loc, name, column):
+    with open(os.path.join(loc, name, column + ".bin"), encoding="ascii") as file:
+        text = file.read()
+    values = json.loads("[" + text[:-1] + "]")
+    return np.fromiter(values, dtype=object, count=len(values))
+
+# Distinct values of a dictionary encoded column, in code order
+def read_dictionary(loc, name, column):
+    with open(os.path.join(loc, name, column + ".dict.json")) as file:
+        values = json.load(file)
+    return np.fromiter(values, dtype=object, count=len(values))
+
+# Dictionary column as a pandas Categorical built straight from its codes, so no python object is made per row.
+# Only for columns of strings (None becomes a missing value), returns None for any other column.
+def read_categorical(loc, name, column, codes):
+    values = read_dictionary(loc, name, column)
+    if not all(value is None or isinstance(value, str) for value in values):
+        return None
+    missing = np.array([value is None for value in values], dtype=bool)
+    if missing.any():
+        # Renumber the codes without the missing value, which gets code -1
+        remap = np.cumsum(~missing) - 1
+        remap[missing] = -1
+        codes, values = remap[codes], values[~missing]
+    return pd.Categorical.from_codes(np.asarray(codes), categories=pd.Index(values, dtype=object))
+
+# Concatenate the partitions of a table, merging the categories of categorical columns
+def concat_partitions(parts):
+    data = {}
+    for column in parts[0].columns:
+        values = [part[column] for part in parts]
+        if all(isinstance(value.dtype, pd.CategoricalDtype) for value in values):
+            data[column] = union_categoricals(values)
+        else:
+            data[column] = pd.concat(values, ignore_index=True)
+    return pd.DataFrame(data)
+
+# Read a table back as one dataframe, only touching the requested columns.
+# Rows with the same value in a dictionary column share one python object, so treat them as read only.
+# With categorical=True dictionary columns of strings are read as pandas categoricals.
+def read_table(loc, name, columns=None, categorical=False):
+    path = os.path.join(loc, name)
+    if not os.path.isdir(path):
+        df = pd.read_pickle(path + ".pkl")
+        return df if columns is None else df[columns]
+
+    partitions = read_partitions(loc, name)
+    if partitions is not None:
+        parts = [read_table(path, key, columns, categorical) for key in partitions]
+        return concat_partitions(parts) if parts else pd.DataFrame(columns=columns)
+
+    meta = read_meta(loc, name)
+    data = {}
+    for column in columns or meta["columns"]:
+        if meta["columns"][column]["kind"] == "json":
+            data[column] = read_json(loc, name, column)
+            continue
+        array = read_array(loc, name, column, meta)
+        if meta["columns"][column]["kind"] == "numeric":
+            data[column] = np.array(array)
+        else:
+            values = read_categorical(loc, name, column, array) if categorical else None
+            data[column] = read_dictionary(loc, name, column)[array] if values is None else values
+    return pd.DataFrame(data)